@@ -1,13 +1,48 @@
 import streamlit as st
 import requests
-import arxiv
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 from io import StringIO
-from groq import Groq
-from fpdf import FPDF
-from google import genai  
 import re
-import PyPDF2
+import zlib
+import math
+import sys
+import importlib
+import time
+import random
+import threading
+import sqlite3
+import hashlib
+import json
+import uuid
+import functools
+import contextvars
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+class LazyModule:
+    # Imported on first attribute access, so a session that never opens Analytica or fetches papers
+    # never pays for pandas/arxiv. importlib.import_module holds the per-module import lock, so threads
+    # touching the module for the first time together all wait for a fully executed module
+    # (importlib.util.LazyLoader is not thread-safe: concurrent first accesses saw missing attributes).
+    # groq, google.genai, fpdf and pdf_extract (PyPDF2) are imported inside the functions that first need them.
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+def lazy_import(name):
+    return sys.modules.get(name) or LazyModule(name)
+
+arxiv = lazy_import("arxiv")
+pd = lazy_import("pandas")
 
 # ==========================================
 # 1. CONFIGURATION & CREDENTIALS
@@ -22,24 +57,692 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 USER_EMAIL = os.getenv("USER_EMAIL")
 
+# Groq limits (free tier defaults for llama-3.3-70b-versatile)
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_MAX_WORKERS = int(os.getenv("GROQ_MAX_WORKERS", "4"))
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "12000"))
+GROQ_COMPLETION_TOKENS = int(os.getenv("GROQ_COMPLETION_TOKENS", "1000"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "5"))
+GROQ_JSON_MODE = os.getenv("GROQ_JSON_MODE", "0") == "1"
+ANALYSIS_REPAIR_ATTEMPTS = int(os.getenv("ANALYSIS_REPAIR_ATTEMPTS", "2"))
+
+# OpenAlex enrichment
+OPENALEX_URL = "https://api.openalex.org/works"
+OPENALEX_DOI_BATCH = 50
+OPENALEX_MAX_WORKERS = int(os.getenv("OPENALEX_MAX_WORKERS", "4"))
+HTTP_TIMEOUT = (5, 20)
+
+# Gemini + on-disk caches
+GEMINI_MODEL = "gemini-2.5-flash"
+CACHE_DIR = os.getenv("SCHOLAR_CACHE_DIR", ".scholar_cache")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+PAPER_STORE_TTL = int(os.getenv("PAPER_STORE_TTL", str(24 * 3600)))
+# Server-side files the UI may open by path (large datasets, arXiv dumps). Unset = path inputs hidden,
+# since in a shared deployment every browser user could otherwise read any file the server can.
+LOCAL_DATA_DIR = os.getenv("SCHOLAR_DATA_DIR", "")
+
+# Semantic re-ranking of fetched papers
+RESEARCH_FETCH_LIMIT = int(os.getenv("RESEARCH_FETCH_LIMIT", "40"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+HASHING_DIM = 4096
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.85"))
+CITATION_WEIGHT = float(os.getenv("CITATION_WEIGHT", "0.3"))
+ENRICH_POOL_FACTOR = 3
+
+# Full-text ingestion (methods/results excerpts instead of abstract-only analysis)
+FULLTEXT_MODE = os.getenv("FULLTEXT_MODE", "0") == "1"
+FULLTEXT_TOKEN_BUDGET = int(os.getenv("FULLTEXT_TOKEN_BUDGET", "3000"))
+FULLTEXT_DOWNLOAD_WORKERS = int(os.getenv("FULLTEXT_DOWNLOAD_WORKERS", "4"))
+FULLTEXT_PROCESSES = int(os.getenv("FULLTEXT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+FULLTEXT_MAX_PDF_BYTES = 50 * 1024 * 1024
+FULLTEXT_CACHE_DIR = os.path.join(CACHE_DIR, "fulltext")
+
+# ManuScriptor context packing
+WRITER_SINGLE_CALL_TOKENS = int(os.getenv("WRITER_SINGLE_CALL_TOKENS", "6000"))
+WRITER_SECTION_TOKEN_BUDGET = int(os.getenv("WRITER_SECTION_TOKEN_BUDGET", "1500"))
+WRITER_CHUNK_CHARS = 800
+WRITER_MAX_WORKERS = int(os.getenv("WRITER_MAX_WORKERS", "6"))
+
+# PDF rendering: a Unicode TTF font is embedded (and subset) when one is available
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH")
+PDF_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/DejaVuSans.ttf",
+    "C:/Windows/Fonts/DejaVuSans.ttf",
+]
+PDF_CACHE_DIR = os.path.join(CACHE_DIR, "pdf")
+
+# Draft Editor map-reduce
+EDITOR_CHUNK_CHARS = int(os.getenv("EDITOR_CHUNK_CHARS", "12000"))
+EDITOR_MAX_WORKERS = int(os.getenv("EDITOR_MAX_WORKERS", "4"))
+
+# Analytica large-data mode
+LARGE_CSV_BYTES = int(os.getenv("LARGE_CSV_BYTES", str(50 * 1024 * 1024)))
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "200000"))
+ANALYST_SAMPLE_ROWS = int(os.getenv("ANALYST_SAMPLE_ROWS", "10000"))
+MAX_TRACKED_CATEGORIES = 10000
+MAX_CATEGORY_LEVELS = 1000
+FLOAT32_ATOL = 5e-4  # pandas' own tolerance for downcasting float64 -> float32
+VIZ_BINS = 30
+VIZ_MAX_POINTS = 500
+VIZ_TOP_CATEGORIES = 20
+SYNTHETIC_MEMORY_ROWS = int(os.getenv("SYNTHETIC_MEMORY_ROWS", "1000000"))
+SYNTHETIC_MAX_COLUMNS = 30
+SYNTHETIC_MAX_CATEGORIES = 50
+STATS_SAMPLE_ROWS = int(os.getenv("STATS_SAMPLE_ROWS", "200000"))
+STATS_MAX_GROUPS = 20
+STATS_ALPHA = 0.05
+STATS_MAX_FINDINGS = 12
 
-# Initialize Clients
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Tracing
+TRACE_DIR = os.getenv("SCHOLAR_TRACE_DIR", os.path.join(CACHE_DIR, "traces"))
+TRACE_OTEL = os.getenv("SCHOLAR_TRACE_OTEL", "0") == "1"
+TRACE_KEEP_RUNS = 50
+# Each span log is rotated to "<name>.1" past this size, so disk use stays below twice the limit
+TRACE_MAX_BYTES = int(os.getenv("SCHOLAR_TRACE_MAX_MB", "20")) * 1024 * 1024
+
+# Server mode: upstream calls in flight across all users, and per user
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "16"))
+SERVER_MAX_PER_USER = int(os.getenv("SERVER_MAX_PER_USER", "4"))
+
+# Background jobs
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))
+JOB_POLL_SECONDS = 1.0
+JOB_PARTIAL_INTERVAL = 0.5
+
+# Initialize Clients (one per process, shared by every session; SDKs load on first use)
+@st.cache_resource
+def get_groq_client():
+    from groq import Groq
+    return Groq(api_key=GROQ_API_KEY)
 
 # 🟢 NEW GEMINI CLIENT INITIALIZATION
-try:
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-except Exception as e:
-    st.error(f"Error initializing Gemini Client: {e}")
+@st.cache_resource
+def get_gemini_client():
+    from google import genai
+    return genai.Client(api_key=GEMINI_API_KEY)
+
+# ==========================================
+# TRACING
+# ==========================================
+current_span = contextvars.ContextVar("current_span", default=None)
+
+def otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otel_span(span):
+    # OTLP/JSON span shape, so the file can be replayed into any OpenTelemetry collector
+    start_ns = int(span['start'] * 1e9)
+    return {
+        "traceId": span['trace_id'],
+        "spanId": span['span_id'],
+        "parentSpanId": span['parent_id'] or "",
+        "name": span['name'],
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(span['duration'] * 1e9)),
+        "attributes": [{"key": k, "value": otel_value(v)} for k, v in span['attributes'].items() if v is not None],
+        "status": {"code": 2 if span['status'] == "error" else 1}
+    }
+
+class Tracer:
+    # Spans for every stage and external call, kept per run in memory and appended to JSON lines on disk
+    def __init__(self, trace_dir, otel=False, keep_runs=TRACE_KEEP_RUNS, max_bytes=TRACE_MAX_BYTES):
+        os.makedirs(trace_dir, exist_ok=True)
+        self.path = os.path.join(trace_dir, "spans.jsonl")
+        self.otel_path = os.path.join(trace_dir, "otel_spans.jsonl") if otel else None
+        self.keep_runs = keep_runs
+        self.max_bytes = max_bytes
+        self.runs = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, activate=True, **attributes):
+        # activate=False records the span without making it the parent of nested spans (used by generators)
+        parent = current_span.get()
+        span = {
+            "trace_id": parent['trace_id'] if parent else uuid.uuid4().hex,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent['span_id'] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "status": "ok",
+            "attributes": dict(attributes)
+        }
+        token = current_span.set(span) if activate else None
+        t0 = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span['status'] = "error"
+            span['attributes']['error'] = str(e)[:200]
+            raise
+        finally:
+            span['duration'] = time.perf_counter() - t0
+            if token is not None:
+                current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        with self.lock:
+            self.runs.setdefault(span['trace_id'], []).append(span)
+            self.runs.move_to_end(span['trace_id'])
+            while len(self.runs) > self.keep_runs:
+                self.runs.popitem(last=False)
+            self._append(self.path, span)
+            if self.otel_path:
+                self._append(self.otel_path, to_otel_span(span))
+
+    def _append(self, path, record):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+            size = f.tell()
+        if size > self.max_bytes:
+            # One rotated generation: the previous "<name>.1" is dropped
+            os.replace(path, path + ".1")
+
+    def trace(self, trace_id):
+        with self.lock:
+            return sorted(self.runs.get(trace_id, []), key=lambda s: s['start'])
+
+@st.cache_resource
+def get_tracer():
+    return Tracer(TRACE_DIR, otel=TRACE_OTEL)
+
+def traced(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def in_context(fn):
+    # Pool threads start with an empty context; binding a copy of the caller's keeps their spans nested
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+# ==========================================
+# SERVER MODE: REQUEST COALESCING & FAIRNESS
+# ==========================================
+# Identifies the browser session (or batch topic) that upstream work is done for
+current_user = contextvars.ContextVar("current_user", default="default")
+
+class SingleFlight:
+    # Concurrent calls with the same key run once; the other callers wait for the leader's result
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+        if not leader:
+            with get_tracer().span("singleflight.wait", key=str(key)[:80]):
+                call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+class FairGate:
+    # Caps upstream calls globally and per user; a freed slot goes to the waiting user with the fewest calls in flight
+    def __init__(self, max_total, max_per_user):
+        self.max_total = max_total
+        self.max_per_user = max_per_user
+        self.cond = threading.Condition()
+        self.active = {}
+        self.waiting = []
+        self.seq = 0
+
+    def _next(self):
+        eligible = [w for w in self.waiting if self.active.get(w[1], 0) < self.max_per_user]
+        return min(eligible, key=lambda w: (self.active.get(w[1], 0), w[0]), default=None)
+
+    @contextmanager
+    def slot(self, user=None):
+        user = user or current_user.get()
+        with self.cond:
+            self.seq += 1
+            ticket = (self.seq, user)
+            self.waiting.append(ticket)
+            while sum(self.active.values()) >= self.max_total or self._next() != ticket:
+                self.cond.wait()
+            self.waiting.remove(ticket)
+            self.active[user] = self.active.get(user, 0) + 1
+            self.cond.notify_all()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active[user] -= 1
+                if not self.active[user]:
+                    del self.active[user]
+                self.cond.notify_all()
+
+@st.cache_resource
+def get_upstream_gate():
+    return FairGate(SERVER_MAX_CONCURRENCY, SERVER_MAX_PER_USER)
+
+# ==========================================
+# LLM RESPONSE CACHE
+# ==========================================
+class LLMCache:
+    # SQLite-backed response store keyed by sha256(model, prompt, temperature) with TTL + LRU eviction
+    def __init__(self, path, ttl, max_entries):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model, prompt, temperature, **options):
+        payload = json.dumps({"model": model, "prompt": prompt, "temperature": temperature, **options}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            now = time.time()
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+    def set(self, key, model, response):
+        with self.lock:
+            now = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, model, response, now, now))
+            excess = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+@st.cache_resource
+def get_llm_cache():
+    return LLMCache(os.path.join(CACHE_DIR, "llm_cache.sqlite"), LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
+
+# ==========================================
+# LLM ACCESS (RATE LIMITS, RETRIES, CACHE)
+# ==========================================
+class RateLimiter:
+    # Sliding one-minute window over both request count and estimated tokens
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0][0] >= 60:
+                    self.calls.popleft()
+                used = sum(t for _, t in self.calls)
+                if not self.calls or (len(self.calls) < self.requests_per_minute and used + tokens <= self.tokens_per_minute):
+                    self.calls.append((now, tokens))
+                    return
+                wait = 60 - (now - self.calls[0][0])
+            time.sleep(min(max(wait, 0.05), 1.0))
+
+@st.cache_resource
+def get_groq_limiter():
+    return RateLimiter(GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE)
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def is_rate_limit_error(e):
+    return getattr(e, "status_code", None) == 429
+
+def retry_delay(e, attempt):
+    delay = random.uniform(0, min(30, 2 ** attempt))
+    response = getattr(e, "response", None)
+    try:
+        delay = max(delay, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return delay
+
+def groq_chat(prompt, temperature=0.7, model=GROQ_MODEL, use_cache=True, response_format=None):
+    # use_cache=False skips the lookup but still stores the fresh answer for later callers.
+    # response_format={"type": "json_object"} turns on Groq JSON mode (the prompt must mention JSON).
+    cache = get_llm_cache()
+    options = {"response_format": response_format} if response_format else {}
+    key = cache.make_key(model, prompt, temperature, **options)
+    with get_tracer().span("groq.chat", model=model, cache_hit=False, retries=0) as span:
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                span['attributes']['cache_hit'] = True
+                return cached
+        
+        limiter = get_groq_limiter()
+        for attempt in range(GROQ_MAX_RETRIES + 1):
+            try:
+                # Throttling waits happen before taking a fairness slot so they never block other upstreams
+                limiter.acquire(estimate_tokens(prompt) + GROQ_COMPLETION_TOKENS)
+                with get_upstream_gate().slot():
+                    response = get_groq_client().chat.completions.create(
+                        messages=[{"role": "user", "content": prompt}],
+                        model=model,
+                        temperature=temperature,
+                        **options
+                    )
+                usage = getattr(response, "usage", None)
+                span['attributes'].update(
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None)
+                )
+                text = response.choices[0].message.content
+                cache.set(key, model, text)
+                return text
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == GROQ_MAX_RETRIES:
+                    raise
+                span['attributes']['retries'] = attempt + 1
+                time.sleep(retry_delay(e, attempt))
+
+def gemini_usage(span, usage):
+    if usage is not None:
+        span['attributes'].update(
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            completion_tokens=getattr(usage, "candidates_token_count", None)
+        )
+
+def gemini_generate(prompt, model=GEMINI_MODEL, use_cache=True):
+    cache = get_llm_cache()
+    key = cache.make_key(model, prompt, None)
+    with get_tracer().span("gemini.generate", model=model, cache_hit=False) as span:
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                span['attributes']['cache_hit'] = True
+                return cached
+        
+        with get_upstream_gate().slot():
+            response = get_gemini_client().models.generate_content(model=model, contents=prompt)
+        gemini_usage(span, getattr(response, "usage_metadata", None))
+        text = response.text
+        if text:
+            cache.set(key, model, text)
+        return text
+
+def gemini_stream(prompt, model=GEMINI_MODEL, use_cache=True, stats=None):
+    # Yields text chunks as Gemini produces them; timings land in `stats` once the stream is drained
+    stats = stats if stats is not None else {}
+    cache = get_llm_cache()
+    key = cache.make_key(model, prompt, None)
+    start = time.perf_counter()
+    with get_tracer().span("gemini.stream", activate=False, model=model, cache_hit=False) as span:
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                span['attributes']['cache_hit'] = True
+                stats.update(cached=True, time_to_first_token=0.0, tokens=estimate_tokens(cached), tokens_per_sec=None)
+                yield cached
+                return
+        
+        parts = []
+        usage = None
+        with get_upstream_gate().slot():
+            for chunk in get_gemini_client().models.generate_content_stream(model=model, contents=prompt):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if not chunk.text:
+                    continue
+                if not parts:
+                    stats['time_to_first_token'] = time.perf_counter() - start
+                parts.append(chunk.text)
+                yield chunk.text
+        
+        text = "".join(parts)
+        elapsed = time.perf_counter() - start
+        gemini_usage(span, usage)
+        stats['cached'] = False
+        stats['tokens'] = span['attributes'].get('completion_tokens') or estimate_tokens(text)
+        stats['tokens_per_sec'] = stats['tokens'] / max(elapsed - stats.get('time_to_first_token', 0.0), 1e-6)
+        span['attributes'].update(time_to_first_token=stats.get('time_to_first_token'), tokens_per_sec=stats['tokens_per_sec'])
+        if text:
+            cache.set(key, model, text)
 
 # ==========================================
 # 2. MODULE 1: DATA MANAGEMENT
 # ==========================================
-def fetch_papers(query, limit=10): 
+FTS_STOPWORDS = {"the", "and", "for", "with", "from", "into", "using", "via", "based", "towards", "of", "on", "in", "a", "an", "to"}
+
+def arxiv_id_from_url(url):
+    # "http://arxiv.org/abs/2101.00001v2" -> "2101.00001"; the store keeps one row per paper, not per version
+    return re.sub(r"v\d+$", "", url.rstrip("/").split("/abs/")[-1])
+
+def fts_query(text, match_all):
+    terms = [t for t in re.findall(r"\w+", text.lower()) if t not in FTS_STOPWORDS]
+    return (" AND " if match_all else " OR ").join(f'"{t}"' for t in terms)
+
+class PaperStore:
+    # Local arXiv/OpenAlex metadata with an FTS5 index over title + abstract
+    COLUMNS = ["arxiv_id", "title", "abstract", "url", "pdf_url", "doi", "date", "citations", "concepts", "fetched", "enriched"]
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS papers (
+                arxiv_id TEXT PRIMARY KEY, title TEXT, abstract TEXT, url TEXT, pdf_url TEXT, doi TEXT,
+                date TEXT, citations INTEGER, concepts TEXT, fetched REAL, enriched REAL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(arxiv_id UNINDEXED, title, abstract);
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT, max_results INTEGER, arxiv_ids TEXT, fetched REAL, PRIMARY KEY (query, max_results));
+            CREATE TABLE IF NOT EXISTS embeddings (
+                arxiv_id TEXT, model TEXT, vector BLOB, PRIMARY KEY (arxiv_id, model));
+        """)
+        self.conn.commit()
+
+    def _row_to_paper(self, row):
+        p = dict(zip(self.COLUMNS, row))
+        p['concepts'] = json.loads(p['concepts']) if p['concepts'] else []
+        if p['enriched'] is None:
+            del p['citations'], p['concepts']
+        del p['fetched'], p['enriched']
+        return p
+
+    def _write_papers(self, papers, fetched):
+        for p in papers:
+            self.conn.execute("""
+                INSERT INTO papers (arxiv_id, title, abstract, url, pdf_url, doi, date, fetched)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(arxiv_id) DO UPDATE SET title = excluded.title, abstract = excluded.abstract,
+                    url = excluded.url, pdf_url = excluded.pdf_url, doi = excluded.doi, date = excluded.date,
+                    fetched = excluded.fetched""",
+                (p['arxiv_id'], p['title'], p['abstract'], p['url'], p['pdf_url'], p['doi'], p['date'], fetched))
+            self.conn.execute("DELETE FROM papers_fts WHERE arxiv_id = ?", (p['arxiv_id'],))
+            self.conn.execute("INSERT INTO papers_fts (arxiv_id, title, abstract) VALUES (?, ?, ?)",
+                              (p['arxiv_id'], p['title'], p['abstract']))
+
+    def upsert_papers(self, papers, fetched=None):
+        with self.lock:
+            self._write_papers(papers, fetched or time.time())
+            self.conn.commit()
+
+    def get_papers(self, arxiv_ids):
+        if not arxiv_ids:
+            return []
+        with self.lock:
+            marks = ",".join("?" * len(arxiv_ids))
+            rows = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM papers WHERE arxiv_id IN ({marks})", arxiv_ids).fetchall()
+        by_id = {row[0]: self._row_to_paper(row) for row in rows}
+        return [by_id[i] for i in arxiv_ids if i in by_id]
+
+    def record_search(self, query, max_results, arxiv_ids):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                              (query.strip().lower(), max_results, json.dumps(arxiv_ids), time.time()))
+            self.conn.commit()
+
+    def cached_search(self, query, max_results, max_age):
+        with self.lock:
+            row = self.conn.execute("SELECT arxiv_ids, fetched FROM searches WHERE query = ? AND max_results = ?",
+                                    (query.strip().lower(), max_results)).fetchone()
+        if not row or time.time() - row[1] > max_age:
+            return None
+        arxiv_ids = json.loads(row[0])
+        papers = self.get_papers(arxiv_ids)
+        return papers if len(papers) == len(arxiv_ids) else None
+
+    def search(self, query, limit, max_age=None, match_all=True):
+        match = fts_query(query, match_all)
+        if not match:
+            return []
+        sql = f"""SELECT {', '.join('p.' + c for c in self.COLUMNS)} FROM papers_fts f
+                  JOIN papers p ON p.arxiv_id = f.arxiv_id
+                  WHERE papers_fts MATCH ?"""
+        params = [match]
+        if max_age is not None:
+            sql += " AND p.fetched >= ?"
+            params.append(time.time() - max_age)
+        sql += " ORDER BY bm25(papers_fts) LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_to_paper(row) for row in rows]
+
+    def get_enrichment(self, arxiv_ids, max_age):
+        if not arxiv_ids:
+            return {}
+        with self.lock:
+            marks = ",".join("?" * len(arxiv_ids))
+            rows = self.conn.execute(
+                f"SELECT arxiv_id, citations, concepts FROM papers WHERE arxiv_id IN ({marks}) AND enriched >= ?",
+                [*arxiv_ids, time.time() - max_age]).fetchall()
+        return {r[0]: {"citations": r[1], "concepts": json.loads(r[2] or "[]")} for r in rows}
+
+    def set_enrichment(self, enrichment):
+        with self.lock:
+            now = time.time()
+            self.conn.executemany("UPDATE papers SET citations = ?, concepts = ?, enriched = ? WHERE arxiv_id = ?",
+                                  [(m['citations'], json.dumps(m['concepts']), now, i) for i, m in enrichment.items()])
+            self.conn.commit()
+
+    def get_embeddings(self, arxiv_ids, model):
+        if not arxiv_ids:
+            return {}
+        with self.lock:
+            marks = ",".join("?" * len(arxiv_ids))
+            rows = self.conn.execute(f"SELECT arxiv_id, vector FROM embeddings WHERE model = ? AND arxiv_id IN ({marks})",
+                                     [model, *arxiv_ids]).fetchall()
+        return {r[0]: np.frombuffer(r[1], dtype=np.float32) for r in rows}
+
+    def set_embeddings(self, vectors, model):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                  [(i, model, np.asarray(v, dtype=np.float32).tobytes()) for i, v in vectors.items()])
+            self.conn.commit()
+
+    def import_arxiv_metadata(self, path, batch_size=5000):
+        # Accepts the arXiv OAI metadata snapshot (one JSON object per line) or a JSON array fixture
+        with open(path, encoding="utf-8") as f:
+            head = f.read(1)
+            f.seek(0)
+            records = json.load(f) if head == "[" else (json.loads(line) for line in f if line.strip())
+            count = 0
+            batch = []
+            for record in records:
+                batch.append(paper_from_oai_record(record))
+                if len(batch) >= batch_size:
+                    count += self._import_batch(batch)
+                    batch = []
+            if batch:
+                count += self._import_batch(batch)
+        return count
+
+    def _import_batch(self, batch):
+        with self.lock:
+            self._write_papers(batch, time.time())
+            self.conn.commit()
+        return len(batch)
+
+def paper_from_oai_record(record):
+    arxiv_id = record['id']
+    versions = record.get('versions') or []
+    created = versions[0].get('created', "") if versions else ""
+    year = re.search(r"\b(\d{4})\b", created)
+    return {
+        "arxiv_id": arxiv_id,
+        "title": " ".join(record.get('title', "").split()),
+        "abstract": " ".join(record.get('abstract', "").split()),
+        "url": f"http://arxiv.org/abs/{arxiv_id}{versions[-1]['version'] if versions else ''}",
+        "pdf_url": f"http://arxiv.org/pdf/{arxiv_id}{versions[-1]['version'] if versions else ''}",
+        "doi": record.get('doi'),
+        "date": year.group(1) if year else (record.get('update_date') or "")[:4]
+    }
+
+@st.cache_resource
+def get_paper_store():
+    return PaperStore(os.path.join(CACHE_DIR, "papers.sqlite"))
+
+@traced("arxiv.request")
+def fetch_papers_remote(query, limit):
     search = arxiv.Search(query=query, max_results=limit, sort_by=arxiv.SortCriterion.Relevance)
     results = []
-    for r in search.results():
+    with get_upstream_gate().slot():
+        records = list(search.results())
+    for r in records:
         results.append({
+            "arxiv_id": arxiv_id_from_url(r.entry_id),
             "title": r.title,
             "abstract": r.summary.replace("\n", " "),
             "url": r.entry_id,
@@ -49,70 +752,451 @@ def fetch_papers(query, limit=10):
         })
     return results
 
-def enrich_metadata(title):
-    base_url = "https://api.openalex.org/works"
-    params = {"filter": f"title.search:{title}", "mailto": USER_EMAIL}
+def fetch_papers(query, limit=10, use_store=True): 
+    with get_tracer().span("stage.fetch", limit=limit) as span:
+        # Users searching the same topic at the same time share one upstream fetch
+        results, span['attributes']['source'] = get_single_flight().do(
+            ("fetch_papers", query.strip().lower(), limit, use_store), fetch_papers_from, query, limit, use_store
+        )
+        span['attributes']['results'] = len(results)
+        return [dict(p) for p in results]
+
+def fetch_papers_from(query, limit, use_store):
+    store = get_paper_store()
+    if use_store:
+        cached = store.cached_search(query, limit, PAPER_STORE_TTL)
+        if cached is not None:
+            return cached, "store_query"
+        local = store.search(query, limit, max_age=PAPER_STORE_TTL)
+        if len(local) >= limit:
+            return local, "store_fts"
+    
+    try:
+        results = fetch_papers_remote(query, limit)
+    except Exception:
+        # arXiv unreachable: serve whatever the store has, however old
+        offline = store.search(query, limit, match_all=False)
+        if offline:
+            return offline, "store_offline"
+        raise
+    store.upsert_papers(results)
+    store.record_search(query, limit, [p['arxiv_id'] for p in results])
+    return results, "arxiv"
+
+@st.cache_resource
+def get_http_session():
+    # One keep-alive pool shared by every OpenAlex/PDF request, with retries on throttling and 5xx
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def normalize_doi(doi):
+    if not doi:
+        return None
+    doi = doi.strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi
+
+def openalex_get(session, params, kind):
+    with get_tracer().span("openalex.request", kind=kind) as span:
+        res = session.get(OPENALEX_URL, params=params, timeout=HTTP_TIMEOUT)
+        retries = getattr(getattr(res.raw, "retries", None), "history", None)
+        span['attributes'].update(status=res.status_code, retries=len(retries) if retries else 0)
+        return res.json()
+
+def parse_openalex_work(work):
+    return {
+        "citations": work.get("cited_by_count", 0),
+        "concepts": [c['display_name'] for c in work.get("concepts", [])[:3]]
+    }
+
+def lookup_title(title, session):
+    # None means the lookup itself failed; a paper OpenAlex does not know gets zero citations.
+    # Commas separate filters in OpenAlex syntax, so they cannot appear inside the search value.
+    params = {"filter": f"title.search:{title.replace(',', ' ')}", "mailto": USER_EMAIL, "per-page": 1}
     try:
-        res = requests.get(base_url, params=params).json()
+        res = openalex_get(session, params, "title")
         if res['results']:
-            work = res['results'][0]
-            return {
-                "citations": work.get("cited_by_count", 0),
-                "concepts": [c['display_name'] for c in work.get("concepts", [])[:3]]
-            }
+            return parse_openalex_work(res['results'][0])
+        return {"citations": 0, "concepts": []}
     except:
-        pass
-    return {"citations": 0, "concepts": []}
+        return None
+
+def enrich_metadata(title, session=None):
+    return lookup_title(title, session or get_http_session()) or {"citations": 0, "concepts": []}
+
+def enrich_by_doi(dois, session):
+    found = {}
+    for i in range(0, len(dois), OPENALEX_DOI_BATCH):
+        batch = dois[i:i + OPENALEX_DOI_BATCH]
+        params = {
+            "filter": "doi:" + "|".join(batch),
+            "select": "doi,cited_by_count,concepts",
+            "per-page": len(batch),
+            "mailto": USER_EMAIL
+        }
+        try:
+            res = openalex_get(session, params, "doi_batch")
+        except:
+            continue
+        for work in res.get('results', []):
+            found[normalize_doi(work.get('doi'))] = parse_openalex_work(work)
+    return found
+
+def enrich_metadata_batch(papers):
+    with get_tracer().span("stage.enrich", papers=len(papers)) as span:
+        return enrich_metadata_cached(papers, span)
+
+def enrich_metadata_cached(papers, span):
+    store = get_paper_store()
+    known = store.get_enrichment([p['arxiv_id'] for p in papers if p.get('arxiv_id')], PAPER_STORE_TTL)
+    span['attributes']['cache_hits'] = len(known)
+    for p in papers:
+        if p.get('arxiv_id') in known:
+            p.update(known[p['arxiv_id']])
+    stale = [p for p in papers if p.get('arxiv_id') not in known]
+    if stale:
+        resolved = enrich_metadata_remote(stale)
+        store.set_enrichment({p['arxiv_id']: p for p in resolved if p.get('arxiv_id')})
+    return papers
+
+def enrich_metadata_remote(papers):
+    session = get_http_session()
+    dois = sorted({normalize_doi(p.get('doi')) for p in papers if p.get('doi')})
+    by_doi = enrich_by_doi(dois, session) if dois else {}
+    
+    # Title search is only a fallback for papers OpenAlex could not resolve by DOI
+    missing = [p for p in papers if normalize_doi(p.get('doi')) not in by_doi]
+    by_title = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=OPENALEX_MAX_WORKERS) as pool:
+            results = [f.result() for f in [pool.submit(in_context(lookup_title), p['title'], session) for p in missing]]
+            by_title = {id(p): metadata for p, metadata in zip(missing, results)}
+    
+    # Returns the papers that were actually resolved, so failed lookups are not persisted
+    resolved = []
+    for p in papers:
+        metadata = by_title[id(p)] if id(p) in by_title else by_doi[normalize_doi(p.get('doi'))]
+        if metadata is not None:
+            resolved.append(p)
+        metadata = metadata or {"citations": 0, "concepts": []}
+        p['citations'] = metadata['citations']
+        p['concepts'] = metadata['concepts']
+    return resolved
+
+@st.cache_resource
+def get_embedding_model():
+    # Optional: sentence-transformers on CPU. Without it (or offline) ranking falls back to hashed TF-IDF.
+    if not EMBEDDING_MODEL:
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    except Exception:
+        return None
+
+def title_and_abstract(p):
+    return f"{p['title']}. {p['abstract']}"
+
+def hashed_term_counts(text):
+    # Stable (crc32) feature hashing of unigrams + bigrams, so cached vectors stay valid across processes
+    tokens = [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in FTS_STOPWORDS]
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    idx = np.fromiter((zlib.crc32(g.encode("utf-8")) % HASHING_DIM for g in grams), dtype=np.int64, count=len(grams))
+    return np.bincount(idx, minlength=HASHING_DIM).astype(np.float32)
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def paper_vectors(papers):
+    # Cached per arXiv ID: model embeddings, or raw hashed counts (IDF depends on the batch, so it is applied later)
+    model = get_embedding_model()
+    model_name = EMBEDDING_MODEL if model is not None else f"hashing-{HASHING_DIM}"
+    store = get_paper_store()
+    cached = store.get_embeddings([p['arxiv_id'] for p in papers if p.get('arxiv_id')], model_name)
+    todo = [p for p in papers if p.get('arxiv_id') not in cached]
+    if todo:
+        if model is not None:
+            fresh = model.encode([title_and_abstract(p) for p in todo], batch_size=32, normalize_embeddings=True)
+        else:
+            fresh = np.vstack([hashed_term_counts(title_and_abstract(p)) for p in todo])
+        computed = dict(zip(map(id, todo), fresh))
+        store.set_embeddings({p['arxiv_id']: computed[id(p)] for p in todo if p.get('arxiv_id')}, model_name)
+    vectors = np.vstack([cached[p['arxiv_id']] if p.get('arxiv_id') in cached else computed[id(p)] for p in papers])
+    return model, vectors
+
+def semantic_scores(papers, topic):
+    # Returns unit-length document vectors and each paper's cosine relevance to the topic
+    model, vectors = paper_vectors(papers)
+    if model is not None:
+        docs = normalize_rows(vectors)
+        return docs, docs @ model.encode([topic], normalize_embeddings=True)[0]
+    counts = np.vstack([vectors, hashed_term_counts(topic)])
+    doc_freq = (counts[:-1] > 0).sum(axis=0)
+    idf = np.log((1 + len(papers)) / (1 + doc_freq)) + 1
+    weighted = normalize_rows(np.log1p(counts) * idf)
+    return weighted[:-1], weighted[:-1] @ weighted[-1]
+
+def collapse_near_duplicates(order, docs):
+    # Greedy: walk papers best-first and drop any whose cosine similarity to a kept paper is too high
+    kept = []
+    for i in order:
+        if not kept or (docs[kept] @ docs[i]).max() < DEDUP_SIMILARITY:
+            kept.append(i)
+    return kept
 
-def clean_and_deduplicate(papers):
+def rerank_papers(papers, topic, keep):
+    docs, relevance = semantic_scores(papers, topic)
+    distinct = collapse_near_duplicates(list(np.argsort(-relevance, kind="stable")), docs)
+    # Citations only matter for the final blend, so only the most relevant candidates are enriched
+    pool = [papers[i] for i in distinct[:keep * ENRICH_POOL_FACTOR]]
+    enrich_metadata_batch(pool)
+    citations = np.array([p.get('citations', 0) for p in pool], dtype=np.float64)
+    citation_score = np.log1p(citations) / max(np.log1p(citations.max()), 1e-9) if len(pool) else citations
+    rel = relevance[distinct[:len(pool)]]
+    scores = (1 - CITATION_WEIGHT) * rel + CITATION_WEIGHT * citation_score
+    ranked = []
+    for i in np.argsort(-scores, kind="stable")[:keep]:
+        pool[i]['relevance'] = round(float(scores[i]), 4)
+        ranked.append(pool[i])
+    return ranked
+
+@traced("stage.clean")
+def clean_and_deduplicate(papers, keep=5, topic=None):
     clean_list = []
     seen_titles = set()
     for p in papers:
         if p['title'] in seen_titles: continue
         seen_titles.add(p['title'])
         if not p['abstract'] or len(p['abstract']) < 50: continue
-        metadata = enrich_metadata(p['title'])
-        p['citations'] = metadata['citations']
-        p['concepts'] = metadata['concepts']
         clean_list.append(p)
-    return clean_list[:5]
+    if topic and len(clean_list) > 1:
+        return rerank_papers(clean_list, topic, keep)
+    # Cut before enrichment so no network work is spent on papers that get dropped
+    return enrich_metadata_batch(clean_list[:keep])
 
 # ==========================================
 # 3. MODULE 2: RESEARCHER (GROQ)
 # ==========================================
+ANALYSIS_DEFAULTS = {
+    "summary": "Summary not generated.",
+    "methodology": "Methodology not generated.",
+    "analysis": "Analysis not generated.",
+    "hypothesis": "Hypothesis not generated."
+}
+
+# Header spellings the model actually uses, mapped to the section they open
+ANALYSIS_HEADER_SYNONYMS = {
+    "technical summary": "summary", "summary": "summary", "overview": "summary",
+    "methodology": "methodology", "methods": "methodology", "method": "methodology", "approach": "methodology",
+    "critical analysis": "analysis", "analysis": "analysis", "key themes": "analysis",
+    "novel hypothesis": "hypothesis", "hypotheses": "hypothesis", "hypothesis": "hypothesis",
+}
+
+# One line-anchored pattern for every variant: "SUMMARY:", "**Summary**", "**Summary:**", "## Methodology",
+# "3. Analysis", "### 4. **Hypothesis**". Without a colon the header must sit alone on its line,
+# so prose such as "Summary of results..." is not mistaken for a header; see is_analysis_header for
+# the undecorated "Name: text" form.
+ANALYSIS_HEADER_RE = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]*)?(?:\d+[.)][ \t]*)?(?P<bold>\*\*|__)?[ \t]*(?:\d+[.)][ \t]*)?"
+    r"(?P<name>" + "|".join(sorted(map(re.escape, ANALYSIS_HEADER_SYNONYMS), key=len, reverse=True)) + r")"
+    r"[ \t]*(?(bold)(?::[ \t]*)?(?:\*\*|__)[ \t]*:?|(?::|(?=[ \t]*$)))",
+    re.IGNORECASE | re.MULTILINE
+)
+
+# The prompt's own "SUMMARY: ... METHODOLOGY: ..." markers when the model puts them on one line
+# (matches at a line start duplicate a line header and are skipped by the scan)
+ANALYSIS_INLINE_HEADER_RE = re.compile(r"\b(?P<name>SUMMARY|METHODOLOGY|ANALYSIS|HYPOTHESIS):")
+
+def is_analysis_header(match, text):
+    # Markdown headings, headers alone on their line and bold "**Name:** text" accept every synonym.
+    # A bare or numbered "Name: text" line only counts for the four prompt headers in capitals, so
+    # body lines such as "Analysis: of the results..." or list items like "2. **Methodology**: ..."
+    # stay in the section they belong to.
+    name = match.group('name')
+    head = match.group(0).lstrip()
+    if head.startswith("#"):
+        return True
+    line_end = text.find("\n", match.end())
+    if not text[match.end():line_end if line_end != -1 else len(text)].strip():
+        return True
+    if match.group('bold') and not head[0].isdigit():
+        return True
+    return name.isupper() and name.lower() in ANALYSIS_DEFAULTS
+
 def parse_markdown_sections(text):
-    sections = {
-        "summary": "Summary not generated.",
-        "methodology": "Methodology not generated.",
-        "analysis": "Analysis not generated.",
-        "hypothesis": "Hypothesis not generated."
-    }
-    
-    s_match = re.search(r"SUMMARY:\s*(.*?)\s*(?=METHODOLOGY:|ANALYSIS:|HYPOTHESIS:|$)", text, re.DOTALL | re.IGNORECASE)
-    m_match = re.search(r"METHODOLOGY:\s*(.*?)\s*(?=ANALYSIS:|HYPOTHESIS:|$)", text, re.DOTALL | re.IGNORECASE)
-    a_match = re.search(r"ANALYSIS:\s*(.*?)\s*(?=HYPOTHESIS:|$)", text, re.DOTALL | re.IGNORECASE)
-    h_match = re.search(r"HYPOTHESIS:\s*(.*)", text, re.DOTALL | re.IGNORECASE)
-    
-    if s_match: 
-        sections['summary'] = s_match.group(1).strip()
-    if m_match: 
-        sections['methodology'] = m_match.group(1).strip()
-    if a_match: 
-        sections['analysis'] = a_match.group(1).strip()
-    if h_match: 
-        sections['hypothesis'] = h_match.group(1).strip()
-            
+    # Single linear scan over the headers: each one closes the previous section
+    headers = [m for m in ANALYSIS_HEADER_RE.finditer(text) if is_analysis_header(m, text)]
+    if len({ANALYSIS_HEADER_SYNONYMS[m.group('name').lower()] for m in headers}) < len(ANALYSIS_DEFAULTS):
+        # Fallback for headers run together on one line
+        headers += ANALYSIS_INLINE_HEADER_RE.finditer(text)
+        headers.sort(key=lambda m: m.start())
+    found = {}
+    key = None
+    pos = 0
+    for match in headers:
+        if match.start() < pos:
+            continue
+        if key:
+            found.setdefault(key, []).append(text[pos:match.start()])
+        key = ANALYSIS_HEADER_SYNONYMS[match.group('name').lower()]
+        pos = match.end()
+    if key:
+        found.setdefault(key, []).append(text[pos:])
+
+    sections = dict(ANALYSIS_DEFAULTS)
+    for key, parts in found.items():
+        body = "\n".join(p.strip() for p in parts if p.strip())
+        if body:
+            sections[key] = body
     return sections
 
-def agent_logic_processor(paper_list):
-    processed_kb = []
-    progress_bar = st.progress(0)
-    
-    for i, paper in enumerate(paper_list):
-        prompt = f"""
-        Act as a Ph.D. Researcher. Analyze this abstract:
+def missing_sections(sections):
+    return [k for k, default in ANALYSIS_DEFAULTS.items() if sections.get(k, default) == default]
+
+def parse_analysis_json(text, keys):
+    # Validates JSON-mode output: an object whose requested keys are non-empty strings
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    data = {str(k).lower(): v for k, v in data.items()}
+    return {k: data[k].strip() for k in keys if isinstance(data.get(k), str) and data[k].strip()}
+
+# --- Full text: download once, extract in worker processes, keep methods/results only ---
+# PDF text wraps body lines, so a line merely starting with "Methods ..." is not a heading here. A full-text
+# heading is a top-level number or roman numeral plus a few title-case words and no sentence punctuation;
+# numbered subsections (3.1 ...) stay inside their parent section.
+FULLTEXT_HEADING_RE = re.compile(
+    r"^[ \t]*(?:\d{1,2}\.?|[IVX]{1,4}\.)[ \t]+"
+    r"([A-Z][A-Za-z-]*(?:[ \t]+(?:[A-Z][A-Za-z-]*|and|of|for|the|in|on|with|&)){0,6})[ \t]*$",
+    re.MULTILINE
+)
+# Sections worth the analysis budget, in the order they are taken
+FULLTEXT_SECTION_PRIORITY = (
+    ("methods", re.compile(r"method", re.IGNORECASE)),
+    ("results", re.compile(r"results|experiment", re.IGNORECASE)),
+    ("discussion", re.compile(r"discussion", re.IGNORECASE)),
+)
+
+def arxiv_version_key(paper):
+    # "2101.00001v2" (or "hep-th/9901001v1"); the version matters because a revised PDF is a different text
+    url = paper.get('url') or paper.get('pdf_url') or ""
+    key = url.rstrip("/").split("/abs/")[-1].split("/pdf/")[-1]
+    key = key[:-4] if key.endswith(".pdf") else key
+    return key or paper.get('arxiv_id')
+
+def fulltext_cache_path(key):
+    return os.path.join(FULLTEXT_CACHE_DIR, re.sub(r"[^A-Za-z0-9.\-]", "_", key) + ".txt")
+
+@st.cache_resource
+def get_pdf_process_pool():
+    # spawn: forking a process that already runs Streamlit/HTTP threads can deadlock the child
+    return ProcessPoolExecutor(max_workers=FULLTEXT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+def download_pdf(url):
+    with get_tracer().span("fulltext.download", url=url, status=None, bytes=0) as span:
+        with get_upstream_gate().slot():
+            response = get_http_session().get(url.replace("http://", "https://", 1), timeout=HTTP_TIMEOUT)
+        span['attributes'].update(status=response.status_code, bytes=len(response.content))
+        response.raise_for_status()
+        if len(response.content) > FULLTEXT_MAX_PDF_BYTES or not response.content.startswith(b"%PDF"):
+            raise ValueError(f"not a usable PDF: {url}")
+        return response.content
+
+def fetch_full_texts(papers):
+    # Returns {version key: text}. Cached texts are read from disk; the rest are downloaded on a thread
+    # pool and each PDF is handed to the process pool as soon as it arrives, so parsing overlaps downloads.
+    texts, missing = {}, {}
+    for p in papers:
+        key = arxiv_version_key(p)
+        if not key or not p.get('pdf_url'):
+            continue
+        path = fulltext_cache_path(key)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                texts[key] = f.read()
+        else:
+            missing[key] = p['pdf_url']
+    if not missing:
+        return texts
+
+    from pdf_extract import extract_text
+    os.makedirs(FULLTEXT_CACHE_DIR, exist_ok=True)
+    parses = {}
+    with ThreadPoolExecutor(max_workers=FULLTEXT_DOWNLOAD_WORKERS) as pool:
+        downloads = {pool.submit(in_context(download_pdf), url): key for key, url in missing.items()}
+        for future in as_completed(downloads):
+            try:
+                parses[get_pdf_process_pool().submit(extract_text, future.result())] = downloads[future]
+            except Exception:
+                continue
+    for future in as_completed(parses):
+        key = parses[future]
+        try:
+            text = future.result()
+        except Exception:
+            continue
+        tmp = f"{fulltext_cache_path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, fulltext_cache_path(key))
+        texts[key] = text
+    return texts
+
+def select_sections(text, token_budget=FULLTEXT_TOKEN_BUDGET):
+    # Splits on detected headings and spends the budget on methods, then results, then discussion
+    headings = list(FULLTEXT_HEADING_RE.finditer(text))
+    sections = {}
+    for i, match in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        for name, pattern in FULLTEXT_SECTION_PRIORITY:
+            if pattern.search(match.group(1)):
+                sections.setdefault(name, []).append(text[match.start():end].strip())
+                break
+    excerpts = []
+    remaining = token_budget * 4
+    for name, _ in FULLTEXT_SECTION_PRIORITY:
+        for body in sections.get(name, []):
+            if remaining <= 0:
+                break
+            excerpts.append(body[:remaining])
+            remaining -= len(excerpts[-1])
+    return "\n\n".join(excerpts)
+
+@traced("stage.fulltext")
+def attach_full_text(papers, token_budget=FULLTEXT_TOKEN_BUDGET):
+    # Adds `full_text` (methods/results excerpts) to each paper whose PDF could be fetched and parsed
+    texts = fetch_full_texts(papers)
+    for p in papers:
+        excerpt = select_sections(texts.get(arxiv_version_key(p), ""), token_budget)
+        if excerpt:
+            p['full_text'] = excerpt
+    return papers
+
+def analysis_source(paper):
+    # Shared by the free-text and JSON prompts; abstract-only papers keep the original wording (and cache keys)
+    if paper.get('full_text'):
+        return f"""Analyze this paper:
         TITLE: {paper['title']}
         ABSTRACT: {paper['abstract']}
+        FULL-TEXT EXCERPTS (methods and results):
+        {paper['full_text']}"""
+    return f"""Analyze this abstract:
+        TITLE: {paper['title']}
+        ABSTRACT: {paper['abstract']}"""
+
+def build_analysis_prompt(paper):
+    return f"""
+        Act as a Ph.D. Researcher. {analysis_source(paper)}
         
         Strictly output the analysis using these 4 Headers.
         
@@ -128,24 +1212,82 @@ def agent_logic_processor(paper_list):
         HYPOTHESIS:
         [Propose 1 novel hypothesis in bold text.]
         """
-        try:
-            chat_completion = groq_client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.3-70b-versatile",
-                temperature=0.7 
-            )
-            raw_text = chat_completion.choices[0].message.content
-            parsed = parse_markdown_sections(raw_text)
-            paper.update(parsed)
-            
-        except Exception as e:
-            paper["summary"] = f"Error: {str(e)}"
+
+ANALYSIS_FIELD_GUIDE = {
+    "summary": "a VERY DETAILED 200-word technical summary",
+    "methodology": "the methods in at least 15 lines, specific about algorithms/data",
+    "analysis": "5 Key Themes and 1 Critical Research Gap",
+    "hypothesis": "1 novel hypothesis",
+}
+
+def build_analysis_json_prompt(paper, keys):
+    fields = "\n".join(f'    "{k}": {ANALYSIS_FIELD_GUIDE[k]}' for k in keys)
+    return f"""
+        Act as a Ph.D. Researcher. {analysis_source(paper)}
         
-        processed_kb.append(paper)
-        progress_bar.progress((i + 1) / len(paper_list))
+        Respond with a JSON object with exactly these string fields:
+{fields}
+        """
+
+def request_sections_json(paper, keys, use_cache=True):
+    # JSON mode for just the requested sections; a reply that fails validation is retried fresh
+    sections = {}
+    for attempt in range(ANALYSIS_REPAIR_ATTEMPTS):
+        pending = [k for k in keys if k not in sections]
+        if not pending:
+            break
+        raw_text = groq_chat(build_analysis_json_prompt(paper, pending), temperature=0.3,
+                             use_cache=use_cache and attempt == 0, response_format={"type": "json_object"})
+        sections.update(parse_analysis_json(raw_text, pending))
+    return sections
+
+def analysis_sections(paper, use_cache=True):
+    if GROQ_JSON_MODE:
+        parsed = dict(ANALYSIS_DEFAULTS)
+        parsed.update(request_sections_json(paper, list(ANALYSIS_DEFAULTS), use_cache))
+        return parsed
+    raw_text = groq_chat(build_analysis_prompt(paper), temperature=0.7, use_cache=use_cache)
+    parsed = parse_markdown_sections(raw_text)
+    missing = missing_sections(parsed)
+    if missing:
+        # Only the sections the free-text answer lacked are asked for again
+        parsed.update(request_sections_json(paper, missing, use_cache))
+    return parsed
+
+def analyze_paper(paper, use_cache=True):
+    try:
+        # The same paper analysed for several users at once costs one Groq call
+        key = ("analyze_paper", paper['title'], paper['abstract'], zlib.crc32(paper.get('full_text', "").encode()), use_cache)
+        paper.update(get_single_flight().do(key, analysis_sections, paper, use_cache))
+    except Exception as e:
+        paper["summary"] = f"Error: {str(e)}"
+    return paper
+
+@traced("stage.analyze")
+def agent_logic_processor(paper_list, use_cache=True, progress=None, completed=None, on_result=None):
+    # `progress(done, total)` is called as each paper finishes; the UI binds it to st.progress.
+    # `completed` maps input index -> paper analysed by an earlier (interrupted) run, which is not redone;
+    # `on_result(index, paper)` fires for each newly analysed paper so callers can persist it.
+    completed = completed or {}
+    processed_kb = [completed.get(i) for i in range(len(paper_list))]
+    pending = [i for i, p in enumerate(processed_kb) if p is None]
+    if not pending:
+        return processed_kb
+    
+    # Results are slotted back by index so processed_kb keeps input order
+    with ThreadPoolExecutor(max_workers=GROQ_MAX_WORKERS) as pool:
+        futures = {pool.submit(in_context(analyze_paper), paper_list[i], use_cache): i for i in pending}
+        for done, future in enumerate(as_completed(futures), start=len(paper_list) - len(pending) + 1):
+            i = futures[future]
+            processed_kb[i] = future.result()
+            if on_result:
+                on_result(i, processed_kb[i])
+            if progress:
+                progress(done, len(paper_list))
     return processed_kb
 
-def global_hypothesis_generator(paper_list, topic):
+@traced("stage.hypothesis")
+def global_hypothesis_generator(paper_list, topic, use_cache=True):
     context = ""
     for p in paper_list:
         context += f"Paper: {p['title']}\nGap: {p.get('analysis', '')}\nHypothesis: {p.get('hypothesis', '')}\n\n"
@@ -157,49 +1299,784 @@ def global_hypothesis_generator(paper_list, topic):
     Output in Markdown format with Big Headings.
     """
     try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.7
-        )
-        return response.choices[0].message.content
+        return groq_chat(prompt, temperature=0.7, use_cache=use_cache)
     except:
         return "Global Hypothesis Generation Failed."
 
 # ==========================================
 # 4. MODULE 3: DATA ANALYST (GROQ)
 # ==========================================
-def generate_synthetic_data(topic):
-    prompt = f"""
-    Act as a Data Generator. Create a realistic CSV dataset for: "{topic}".
-    Requirements: 20 rows, 4 columns (mix categorical/numeric), realistic values.
-    Output ONLY CSV text.
+# The LLM only designs the dataset; rows come from a seeded local sampler
+SYNTHETIC_DISTRIBUTIONS = ("normal", "lognormal", "uniform", "exponential")
+DEFAULT_SYNTHETIC_SCHEMA = {
+    "columns": [
+        {"name": "group", "type": "category", "categories": ["control", "treatment"], "weights": [0.5, 0.5]},
+        {"name": "age", "type": "int", "distribution": "normal", "mean": 40, "std": 12, "min": 18, "max": 90},
+        {"name": "baseline_score", "type": "float", "distribution": "normal", "mean": 50, "std": 10, "missing": 0.03},
+        {"name": "outcome_score", "type": "float", "distribution": "normal", "mean": 55, "std": 12, "missing": 0.05},
+    ],
+    "correlations": [{"a": "baseline_score", "b": "outcome_score", "r": 0.6}, {"a": "group", "b": "outcome_score", "r": 0.3}],
+}
+
+def build_schema_prompt(topic):
+    return f"""
+    Act as a Data Generator. Design a realistic dataset for research on: "{topic}".
+    Respond with a JSON object, no data rows:
+    {{"columns": [{{"name": str, "type": "float" | "int" | "category",
+                   "distribution": one of {list(SYNTHETIC_DISTRIBUTIONS)}, "mean": num, "std": num, "min": num, "max": num,
+                   "categories": [str], "weights": [num], "missing": fraction 0-0.3}}],
+     "correlations": [{{"a": column, "b": column, "r": -1..1}}]}}
+    Use 4-12 columns mixing categorical and numeric ones; numeric fields only for numeric columns,
+    categories/weights only for category columns.
     """
+
+def finite_number(value, default=None):
     try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.5
-        )
-        return response.choices[0].message.content
-    except:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+def validate_synthetic_schema(data):
+    # Anything the sampler cannot use is dropped or defaulted; raises only when no column survives
+    columns = []
+    for spec in (data.get("columns") or [])[:SYNTHETIC_MAX_COLUMNS] if isinstance(data, dict) else []:
+        if not isinstance(spec, dict):
+            continue
+        name = str(spec.get("name", "")).strip()[:64]
+        if not name or any(c['name'] == name for c in columns):
+            continue
+        missing = min(max(finite_number(spec.get("missing"), 0.0), 0.0), 0.5)
+        kind = str(spec.get("type", "float")).lower()
+        if kind in ("category", "categorical", "string", "text", "bool", "boolean"):
+            categories = list(dict.fromkeys(str(c) for c in (spec.get("categories") or []) if str(c).strip()))[:SYNTHETIC_MAX_CATEGORIES]
+            if len(categories) < 2:
+                continue
+            weights = [max(finite_number(w, 0.0), 0.0) for w in (spec.get("weights") or [])]
+            if len(weights) != len(categories) or not sum(weights):
+                weights = [1.0] * len(categories)
+            total = sum(weights)
+            columns.append({"name": name, "type": "category", "categories": categories,
+                            "weights": [w / total for w in weights], "missing": missing})
+            continue
+        low, high = finite_number(spec.get("min")), finite_number(spec.get("max"))
+        if low is not None and high is not None and low >= high:
+            low = high = None
+        distribution = str(spec.get("distribution", "normal")).lower()
+        columns.append({
+            "name": name, "type": "int" if kind in ("int", "integer", "count") else "float",
+            "distribution": distribution if distribution in SYNTHETIC_DISTRIBUTIONS else "normal",
+            "mean": finite_number(spec.get("mean"), 0.0), "std": abs(finite_number(spec.get("std"), 1.0)) or 1.0,
+            "min": low, "max": high, "missing": missing,
+        })
+    if not columns:
+        raise ValueError("schema has no usable columns")
+    names = {c['name'] for c in columns}
+    correlations = []
+    for c in (data.get("correlations") or []):
+        if not isinstance(c, dict):
+            continue
+        r = finite_number(c.get("r"))
+        if c.get("a") in names and c.get("b") in names and c.get("a") != c.get("b") and r is not None:
+            correlations.append({"a": c['a'], "b": c['b'], "r": min(max(r, -0.95), 0.95)})
+    return {"columns": columns, "correlations": correlations}
+
+def synthetic_schema(topic, use_cache=True):
+    try:
+        raw = groq_chat(build_schema_prompt(topic), temperature=0.5, use_cache=use_cache,
+                        response_format={"type": "json_object"})
+        return validate_synthetic_schema(json.loads(raw))
+    except Exception:
+        # A bad or missing schema still yields a well-formed dataset
+        return validate_synthetic_schema(DEFAULT_SYNTHETIC_SCHEMA)
+
+def correlation_factor(schema):
+    # Cholesky factor of the requested correlations, repaired to the nearest valid (PSD) matrix
+    index = {c['name']: i for i, c in enumerate(schema['columns'])}
+    corr = np.eye(len(index))
+    for c in schema['correlations']:
+        corr[index[c['a']], index[c['b']]] = corr[index[c['b']], index[c['a']]] = c['r']
+    values, vectors = np.linalg.eigh(corr)
+    corr = vectors @ np.diag(np.clip(values, 1e-6, None)) @ vectors.T
+    scale = np.sqrt(np.diag(corr))
+    return np.linalg.cholesky(corr / np.outer(scale, scale))
+
+def normal_cdf(z):
+    # Vectorised Phi(z) via the Abramowitz-Stegun erf approximation (|error| < 1.5e-7)
+    x = np.abs(z) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-x * x)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+def synthetic_column(spec, z):
+    # Gaussian copula: one correlated standard normal per column, mapped to the target marginal
+    if spec['type'] == "category":
+        codes = np.searchsorted(np.cumsum(spec['weights'])[:-1], normal_cdf(z), side="right")
+        return pd.Categorical.from_codes(codes, categories=spec['categories'])
+    mean, std, dist = spec['mean'], spec['std'], spec['distribution']
+    if dist == "lognormal" and mean > 0:
+        sigma2 = math.log(1 + (std / mean) ** 2)
+        values = np.exp(math.log(mean) - sigma2 / 2 + math.sqrt(sigma2) * z)
+    elif dist == "uniform":
+        low = spec['min'] if spec['min'] is not None else mean - math.sqrt(3) * std
+        high = spec['max'] if spec['max'] is not None else mean + math.sqrt(3) * std
+        values = low + (high - low) * normal_cdf(z)
+    elif dist == "exponential" and mean > 0:
+        values = -mean * np.log1p(-np.minimum(normal_cdf(z), 1 - 1e-12))
+    else:
+        values = mean + std * z
+    if spec['min'] is not None or spec['max'] is not None:
+        values = np.clip(values, spec['min'], spec['max'])
+    return np.round(values) if spec['type'] == "int" else values
+
+def iter_synthetic_chunks(schema, rows, seed=0, chunksize=CSV_CHUNK_ROWS):
+    # Same schema + rows + seed -> same data, chunk by chunk, without holding more than one chunk
+    rng = np.random.default_rng(seed)
+    factor = correlation_factor(schema)
+    for start in range(0, rows, chunksize):
+        n = min(chunksize, rows - start)
+        z = rng.standard_normal((n, len(schema['columns']))) @ factor.T
+        chunk = {}
+        for i, spec in enumerate(schema['columns']):
+            values = synthetic_column(spec, z[:, i])
+            if spec['missing']:
+                holes = rng.random(n) < spec['missing']
+                if spec['type'] == "category":
+                    values[holes] = np.nan
+                else:
+                    values = np.where(holes, np.nan, values)
+            elif spec['type'] == "int":
+                values = values.astype(np.int64)
+            chunk[spec['name']] = values
+        yield pd.DataFrame(chunk)
+
+def sample_synthetic_data(schema, rows, seed=0):
+    # Small sets come back as a DataFrame; larger ones are written to disk once and analysed out-of-core
+    if rows <= SYNTHETIC_MEMORY_ROWS:
+        return pd.concat(iter_synthetic_chunks(schema, rows, seed), ignore_index=True)
+    digest = hashlib.sha256(json.dumps([schema, rows, seed], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    out_dir = os.path.join(CACHE_DIR, "analytica")
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = pq = None
+    path = os.path.join(out_dir, f"synthetic_{digest}.{'parquet' if pa is not None else 'csv'}")
+    if os.path.exists(path):
+        return path
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    writer = None
+    for i, chunk in enumerate(iter_synthetic_chunks(schema, rows, seed)):
+        if pa is not None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            writer = writer or pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table)
+        else:
+            chunk.to_csv(tmp, mode="a", header=i == 0, index=False)
+    if writer:
+        writer.close()
+    os.replace(tmp, path)
+    return path
+
+@traced("stage.synthetic_data")
+def generate_synthetic_data(topic, rows=1000, seed=0, use_cache=True):
+    # Returns (DataFrame or on-disk path, validated schema)
+    schema = synthetic_schema(topic, use_cache=use_cache)
+    return sample_synthetic_data(schema, rows, seed), schema
+
+def is_numeric_column(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def downcast_frame(df):
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='float')
+        elif series.dtype == object and len(series) and series.nunique(dropna=True) <= len(series) // 2:
+            df[col] = series.astype('category')
+    return df
+
+def local_data_path(path):
+    # Resolves a path typed into the UI; None unless it is an existing file inside LOCAL_DATA_DIR
+    # after following symlinks and "..", so "/etc/passwd" or "../../secret" are refused
+    if not LOCAL_DATA_DIR or not path:
+        return None
+    root = os.path.realpath(LOCAL_DATA_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
         return None
+    return resolved
 
-def data_analyst_agent(df):
-    report = {}
-    df_clean = df.copy()
-    for col in df_clean.columns:
-        if pd.api.types.is_numeric_dtype(df_clean[col]):
-             df_clean[col] = df_clean[col].fillna(df_clean[col].mean())
+def data_source_name(source):
+    return str(getattr(source, 'name', source)).lower()
+
+def data_source_digest(source):
+    # Paths are identified by location, size and mtime (no extra pass over a huge file); uploads,
+    # which are already in memory, by their bytes
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        info = os.stat(source)
+        digest.update(f"{os.path.abspath(source)}\x00{info.st_size}\x00{info.st_mtime_ns}".encode("utf-8"))
+        return digest.hexdigest()
+    source.seek(0)
+    while block := source.read(1 << 20):
+        digest.update(block.encode("utf-8") if isinstance(block, str) else block)
+    source.seek(0)
+    return digest.hexdigest()
+
+def iter_data_chunks(source, chunksize=CSV_CHUNK_ROWS):
+    # A DataFrame is a single chunk; paths/uploads are streamed from CSV or memory-mapped Parquet
+    if isinstance(source, pd.DataFrame):
+        yield source
+        return
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    if data_source_name(source).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source, memory_map=True).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(source, chunksize=chunksize)
+
+def preview_data(source, rows=5):
+    if isinstance(source, pd.DataFrame):
+        return source.head(rows)
+    return next(iter_data_chunks(source, chunksize=rows)).head(rows)
+
+class StreamingStats:
+    # One pass over the chunks: count/mean/variance (Chan's merge), min/max, bounded value counts
+    # for modes, and a per-column reservoir of values for approximate quantiles
+    def __init__(self, reservoir_size=ANALYST_SAMPLE_ROWS, seed=0):
+        self.reservoir_size = reservoir_size
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = {}
+
+    def _new_column(self, series):
+        if pd.api.types.is_datetime64_any_dtype(series):
+            kind = "datetime"
+        elif is_numeric_column(series):
+            kind = "int" if pd.api.types.is_integer_dtype(series) else "float"
         else:
-             df_clean[col] = df_clean[col].fillna(df_clean[col].mode()[0] if not df_clean[col].mode().empty else "Unknown")
+            kind = "category"
+        return {
+            "kind": kind,
+            "count": 0, "missing": 0, "mean": 0.0, "m2": 0.0, "min": None, "max": None,
+            "counts": {}, "overflow": False, "reservoir": np.empty(0), "float32_ok": True
+        }
+
+    def update(self, chunk):
+        for col in chunk.columns:
+            series = chunk[col]
+            c = self.columns.setdefault(col, self._new_column(series))
+            if c['kind'] == "category":
+                self._update_category(c, series)
+            elif c['kind'] == "datetime":
+                self._update_datetime(c, series)
+            else:
+                # Column types are fixed by the first chunk; later values that do not parse become missing
+                self._update_numeric(c, pd.to_numeric(series, errors='coerce'))
+        self.rows += len(chunk)
+        return self
+
+    def _update_numeric(self, c, values):
+        c['missing'] += int(values.isna().sum())
+        arr = values.dropna().to_numpy(dtype='float64')
+        if pd.api.types.is_float_dtype(values) and c['kind'] == "int":
+            c['kind'] = "float"
+        n = len(arr)
+        if n == 0:
+            return
+        if c['float32_ok']:
+            # Same tolerance as pd.to_numeric(downcast='float'): large ids and other values float32
+            # cannot hold keep the column in float64
+            c['float32_ok'] = bool(np.allclose(arr.astype(np.float32), arr, rtol=0.0, atol=FLOAT32_ATOL))
+        mean_b = arr.mean()
+        m2_b = ((arr - mean_b) ** 2).sum()
+        total = c['count'] + n
+        delta = mean_b - c['mean']
+        c['mean'] += delta * n / total
+        c['m2'] += m2_b + delta ** 2 * c['count'] * n / total
+        c['min'] = arr.min() if c['min'] is None else min(c['min'], arr.min())
+        c['max'] = arr.max() if c['max'] is None else max(c['max'], arr.max())
+        # Merge reservoirs: how many survivors come from the old sample follows a hypergeometric draw
+        k = min(self.reservoir_size, total)
+        keep_old = self.rng.hypergeometric(c['count'], n, k) if c['count'] else 0
+        old = self.rng.choice(c['reservoir'], size=min(keep_old, len(c['reservoir'])), replace=False)
+        new = self.rng.choice(arr, size=min(k - len(old), n), replace=False)
+        c['reservoir'] = np.concatenate([old, new])
+        c['count'] = total
+
+    def _update_datetime(self, c, series):
+        # Timestamps only need their range: they order the line charts and are never imputed or binned
+        c['missing'] += int(series.isna().sum())
+        c['count'] += int(series.notna().sum())
+        if series.notna().any():
+            c['min'] = series.min() if c['min'] is None else min(c['min'], series.min())
+            c['max'] = series.max() if c['max'] is None else max(c['max'], series.max())
+
+    def _update_category(self, c, series):
+        c['missing'] += int(series.isna().sum())
+        counts = series.value_counts(dropna=True)
+        c['count'] += int(counts.sum())
+        tracked = c['counts']
+        for value, n in counts.items():
+            if n == 0:
+                continue
+            if value in tracked:
+                tracked[value] += int(n)
+            elif len(tracked) < MAX_TRACKED_CATEGORIES:
+                tracked[value] = int(n)
+            else:
+                c['overflow'] = True
+
+    def mode(self, col):
+        counts = self.columns[col]['counts']
+        if not counts:
+            return None
+        return min(counts, key=lambda v: (-counts[v], str(v)))
+
+    def fill_values(self):
+        fills = {}
+        for col, c in self.columns.items():
+            if c['kind'] == "category":
+                mode = self.mode(col)
+                fills[col] = mode if mode is not None else "Unknown"
+            elif c['kind'] != "datetime" and c['count']:
+                fills[col] = c['mean']
+        return fills
+
+    def dtype_plan(self):
+        # Smallest dtype that holds every value seen in the pass, decided globally rather than per chunk
+        plan = {}
+        for col, c in self.columns.items():
+            if c['kind'] == "datetime":
+                # Left as timestamps (not categories) so find_order_column can use them as the time axis
+                continue
+            if c['kind'] == "int" and c['missing'] == 0 and c['count']:
+                for dtype in (np.int8, np.int16, np.int32, np.int64):
+                    info = np.iinfo(dtype)
+                    if info.min <= c['min'] and c['max'] <= info.max:
+                        plan[col] = dtype
+                        break
+            elif c['kind'] != "category":
+                plan[col] = np.float32 if c['float32_ok'] else np.float64
+            elif not c['overflow'] and len(c['counts']) <= MAX_CATEGORY_LEVELS:
+                levels = list(c['counts'])
+                fill = self.fill_values()[col]
+                if fill not in c['counts']:
+                    levels.append(fill)
+                try:
+                    levels = sorted(levels)
+                except TypeError:
+                    pass
+                plan[col] = pd.CategoricalDtype(levels)
+        return plan
+
+    def describe(self):
+        # describe() of the imputed data: mean-filled cells add rows but no variance
+        table = {}
+        for col, c in self.columns.items():
+            if c['kind'] in ("category", "datetime"):
+                continue
+            rows = c['count'] + c['missing'] if c['count'] else c['count']
+            q = np.quantile(c['reservoir'], [0.25, 0.5, 0.75]) if len(c['reservoir']) else [np.nan] * 3
+            table[col] = {
+                "count": rows,
+                "mean": c['mean'] if c['count'] else np.nan,
+                "std": np.sqrt(c['m2'] / (rows - 1)) if rows > 1 else np.nan,
+                "min": c['min'], "25%": q[0], "50%": q[1], "75%": q[2], "max": c['max']
+            }
+        return pd.DataFrame(table, index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"], dtype='float64')
+
+def profile_data(source):
+    stats = StreamingStats()
+    for chunk in iter_data_chunks(source):
+        stats.update(chunk)
+    return stats
+
+def clean_chunk(chunk, fill_values, plan):
+    # Vectorised imputation: one fillna over the whole frame, never mutating the caller's data
+    widen = {
+        col: chunk[col].cat.add_categories([fill])
+        for col, fill in fill_values.items()
+        if col in chunk and isinstance(chunk[col].dtype, pd.CategoricalDtype) and fill not in chunk[col].cat.categories
+    }
+    if widen:
+        chunk = chunk.assign(**widen)
+    chunk = chunk.fillna(fill_values)
+    for col, dtype in plan.items():
+        if col not in chunk:
+            continue
+        if not isinstance(dtype, pd.CategoricalDtype):
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').fillna(fill_values.get(col, np.nan))
+        chunk[col] = chunk[col].astype(dtype)
+    return chunk
+
+def histogram_edges(stats, bins=VIZ_BINS):
+    # Bin edges come from the min/max of the profiling pass, so every chunk lands in the same bins
+    edges = {}
+    for col, c in stats.columns.items():
+        if c['kind'] in ("category", "datetime") or not c['count']:
+            continue
+        lo, hi = float(c['min']), float(c['max'])
+        n = int(min(bins, hi - lo + 1)) if c['kind'] == "int" else bins
+        edges[col] = np.linspace(lo, hi if hi > lo else lo + 1, max(n, 1) + 1)
+    return edges
+
+def accumulate_histograms(histograms, chunk, edges):
+    for col, col_edges in edges.items():
+        if col not in chunk:
+            continue
+        # Clip so float32 rounding of the extremes cannot push values out of the outer bins
+        values = np.clip(chunk[col].to_numpy(dtype='float64'), col_edges[0], col_edges[-1])
+        counts, _ = np.histogram(values, bins=col_edges)
+        histograms[col] = histograms.get(col, 0) + counts
+    return histograms
+
+def stream_clean(source, fill_values, plan, total_rows, output_path=None, edges=None):
+    # Second pass: impute chunk by chunk, keep a bounded row sample for the UI and spill the
+    # cleaned data to Parquet when pyarrow is available. The spill is keyed by source and cleaning
+    # plan, so rerunning the same file reuses it instead of writing another full copy.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = pq = None
+    if pa is not None and output_path is None:
+        os.makedirs(os.path.join(CACHE_DIR, "analytica"), exist_ok=True)
+        key = json.dumps([data_source_digest(source), fill_values, plan], sort_keys=True, default=str)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        output_path = os.path.join(CACHE_DIR, "analytica", f"cleaned_{digest}.parquet")
+    reuse = output_path is not None and os.path.exists(output_path)
+    spill = pa is not None and not reuse
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp" if spill else None
     
-    report['cleaned_data'] = df_clean
-    report['statistics'] = df_clean.describe()
+    rng = np.random.default_rng(0)
+    frac = min(1.0, ANALYST_SAMPLE_ROWS / max(total_rows, 1))
+    samples = []
+    histograms = {}
+    writer = None
+    for chunk in iter_data_chunks(source):
+        clean = clean_chunk(chunk, fill_values, plan)
+        samples.append(clean[rng.random(len(clean)) < frac])
+        accumulate_histograms(histograms, clean, edges or {})
+        if spill:
+            text_cols = {col: str for col in clean.columns if clean[col].dtype == object}
+            table = pa.Table.from_pandas(clean.astype(text_cols), preserve_index=False)
+            writer = writer or pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+    if writer:
+        writer.close()
+        os.replace(tmp_path, output_path)
+    sample = pd.concat(samples, ignore_index=True) if samples else pd.DataFrame()
+    return sample, (output_path if writer or reuse else None), histograms
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual shape of an ordered series
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    bucket_edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = bucket_edges[i]
+        end = max(bucket_edges[i + 1], start + 1)
+        nxt_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        nxt_start = min(end, nxt_end - 1)
+        avg_x = x[nxt_start:nxt_end].mean()
+        avg_y = y[nxt_start:nxt_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep.append(a)
+    keep.append(n - 1)
+    return np.array(keep)
+
+def find_order_column(df, stats):
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            return col
+    for col in df.columns:
+        c = stats.columns.get(col)
+        if c and c['kind'] != "category" and df[col].is_monotonic_increasing and df[col].nunique() > 1:
+            return col
+    return None
+
+def build_visualizations(report):
+    # Everything sent to the browser is pre-aggregated here: payload size depends on the number of
+    # columns and bins, not on the number of rows
+    stats = report['profile']
+    df = report['cleaned_data']
+    specs = []
+    for col, counts in report['histograms'].items():
+        edges = report['histogram_edges'][col]
+        labels = [f"{(lo + hi) / 2:.4g}" for lo, hi in zip(edges[:-1], edges[1:])]
+        specs.append({"column": col, "chart": "histogram",
+                      "data": pd.DataFrame({"count": counts}, index=pd.Index(labels, name=col))})
+    for col, c in stats.columns.items():
+        if c['kind'] != "category" or not c['counts']:
+            continue
+        counts = pd.Series(c['counts'], dtype='int64')
+        fill = report['fill_values'].get(col)
+        if fill in counts.index:
+            counts[fill] += c['missing']
+        top = counts.nlargest(VIZ_TOP_CATEGORIES)
+        specs.append({"column": col, "chart": "bar", "data": top.rename("count").to_frame()})
+    
+    order_col = find_order_column(df, stats)
+    if order_col is not None:
+        # Timestamps are never imputed: rows without one are left off the line charts, the rest put in time order
+        df = df[df[order_col].notna()].sort_values(order_col, kind='stable')
+        x = df[order_col]
+        x_num = (x.astype('int64') if pd.api.types.is_datetime64_any_dtype(x) else x).to_numpy(dtype='float64')
+        for col in report['histograms']:
+            if col == order_col:
+                continue
+            y = df[col].to_numpy(dtype='float64')
+            idx = lttb(x_num, y, VIZ_MAX_POINTS)
+            specs.append({"column": col, "chart": "line",
+                          "data": pd.DataFrame({col: y[idx]}, index=pd.Index(x.to_numpy()[idx], name=order_col))})
+    return specs
+
+# --- Statistical analysis: computed locally, only a ranked digest reaches the LLM ---
+@functools.lru_cache(maxsize=1)
+def get_scipy_stats():
+    # Optional: exact p-values from scipy. Without it the closed-form approximations below are used.
+    try:
+        from scipy import stats
+        return stats
+    except ImportError:
+        return None
+
+def normal_sf(z):
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def t_pvalue(t, dof):
+    # Two-sided
+    if not np.isfinite(t) or dof <= 0:
+        return 1.0
+    sp = get_scipy_stats()
+    if sp is not None:
+        return float(2 * sp.t.sf(abs(t), dof))
+    z = abs(t) * (1 - 1 / (4 * dof)) / math.sqrt(1 + t * t / (2 * dof))
+    return min(1.0, 2 * normal_sf(z))
+
+def chi2_pvalue(x, dof):
+    if not np.isfinite(x) or dof <= 0:
+        return 1.0
+    sp = get_scipy_stats()
+    if sp is not None:
+        return float(sp.chi2.sf(x, dof))
+    # Wilson-Hilferty cube-root transform
+    z = ((x / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return normal_sf(z)
+
+def f_pvalue(f, d1, d2):
+    if not np.isfinite(f) or d1 <= 0 or d2 <= 0:
+        return 1.0
+    sp = get_scipy_stats()
+    if sp is not None:
+        return float(sp.f.sf(f, d1, d2))
+    # Paulson's normal approximation
+    a, b = 2 / (9 * d1), 2 / (9 * d2)
+    cube = f ** (1 / 3)
+    return normal_sf(((1 - b) * cube - (1 - a)) / math.sqrt(b * cube ** 2 + a))
+
+def benjamini_hochberg(pvalues):
+    # False-discovery-rate adjusted q-values, so many column pairs do not manufacture "significant" noise
+    p = np.asarray(pvalues, dtype=np.float64)
+    if not len(p):
+        return p
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    q = np.minimum.accumulate(ranked[::-1])[::-1]
+    out = np.empty_like(q)
+    out[order] = np.minimum(q, 1.0)
+    return out
+
+def analysis_columns(frame, stats):
+    numeric, categorical = [], []
+    for col in frame.columns:
+        c = stats.columns.get(col)
+        if c is None:
+            continue
+        if c['kind'] in ("int", "float"):
+            if c['count'] > 1 and c['m2'] > 0:
+                numeric.append(col)
+        elif c['kind'] == "category" and 2 <= frame[col].nunique(dropna=True) <= STATS_MAX_GROUPS:
+            categorical.append(col)
+    return numeric, categorical
+
+def correlation_tests(values, numeric):
+    # Pairwise-complete Pearson r; n per pair comes from one matrix product over the not-null mask
+    corr = values.corr()
+    present = values.notna().to_numpy(dtype=np.float64)
+    pair_n = present.T @ present
+    tests = []
+    for i in range(len(numeric)):
+        for j in range(i + 1, len(numeric)):
+            r, n = corr.iat[i, j], pair_n[i, j]
+            if not np.isfinite(r) or n < 4:
+                continue
+            t = r * math.sqrt((n - 2) / max(1 - r * r, 1e-12))
+            tests.append({"test": "correlation", "columns": f"{numeric[i]} ~ {numeric[j]}", "statistic": r,
+                          "effect": abs(r), "p": t_pvalue(t, n - 2), "detail": f"r = {r:+.2f}, n = {int(n)}"})
+    return corr, tests
+
+def outlier_table(values):
+    # Vectorised over all numeric columns at once; NaNs never count as outliers
+    x = values.to_numpy(dtype=np.float64)
+    q1, med, q3 = np.nanpercentile(x, [25, 50, 75], axis=0)
+    iqr = q3 - q1
+    mean, std = np.nanmean(x, axis=0), np.nanstd(x, axis=0)
+    mad = np.nanmedian(np.abs(x - med), axis=0)
+    with np.errstate(invalid="ignore"):
+        flags = {
+            "iqr": (x < q1 - 1.5 * iqr) | (x > q3 + 1.5 * iqr),
+            "zscore": np.abs(x - mean) > 3 * np.where(std > 0, std, np.inf),
+            "mad": 0.6745 * np.abs(x - med) > 3.5 * np.where(mad > 0, mad, np.inf),
+        }
+    n = np.maximum((~np.isnan(x)).sum(axis=0), 1)
+    table = pd.DataFrame({f"{name}_rate": flag.sum(axis=0) / n for name, flag in flags.items()}, index=values.columns)
+    table["lower_fence"] = q1 - 1.5 * iqr
+    table["upper_fence"] = q3 + 1.5 * iqr
+    return table
+
+def group_tests(frame, values, numeric, categorical):
+    # Welch t-test for two groups, one-way ANOVA for more, both from per-group count/mean/var only
+    summaries, tests = {}, []
+    for cat in categorical:
+        agg = values.groupby(frame[cat], observed=True).agg(['count', 'mean', 'var'])
+        summaries[cat] = agg.xs('mean', axis=1, level=1).assign(rows=frame[cat].value_counts())
+        for col in numeric:
+            g = agg[col].dropna()
+            g = g[g['count'] >= 2]
+            if len(g) < 2:
+                continue
+            n, m, v = g['count'].to_numpy(float), g['mean'].to_numpy(float), g['var'].to_numpy(float)
+            if len(g) == 2:
+                se = math.sqrt(v[0] / n[0] + v[1] / n[1])
+                if se == 0:
+                    continue
+                t = (m[0] - m[1]) / se
+                dof = se ** 4 / ((v[0] / n[0]) ** 2 / (n[0] - 1) + (v[1] / n[1]) ** 2 / (n[1] - 1))
+                pooled = math.sqrt(((n[0] - 1) * v[0] + (n[1] - 1) * v[1]) / (n.sum() - 2))
+                d = (m[0] - m[1]) / pooled if pooled else 0.0
+                tests.append({"test": "t-test", "columns": f"{col} by {cat}", "statistic": t,
+                              "effect": abs(d) / math.sqrt(d * d + 4), "p": t_pvalue(t, dof),
+                              "detail": f"{g.index[0]} {m[0]:.3g} vs {g.index[1]} {m[1]:.3g}, Cohen's d = {d:+.2f}"})
+            else:
+                grand = (n * m).sum() / n.sum()
+                ssb = (n * (m - grand) ** 2).sum()
+                ssw = ((n - 1) * v).sum()
+                d1, d2 = len(g) - 1, n.sum() - len(g)
+                if ssw == 0 or d2 <= 0:
+                    continue
+                f = (ssb / d1) / (ssw / d2)
+                eta2 = ssb / (ssb + ssw)
+                top = g['mean'].idxmax()
+                tests.append({"test": "ANOVA", "columns": f"{col} by {cat}", "statistic": f,
+                              "effect": math.sqrt(eta2), "p": f_pvalue(f, d1, d2),
+                              "detail": f"F({d1}, {int(d2)}) = {f:.2f}, eta² = {eta2:.3f}, highest mean: {top}"})
+    return summaries, tests
+
+def chi_square_tests(frame, categorical):
+    tests = []
+    for i in range(len(categorical)):
+        for j in range(i + 1, len(categorical)):
+            a, b = categorical[i], categorical[j]
+            observed = pd.crosstab(frame[a], frame[b]).to_numpy(dtype=np.float64)
+            if min(observed.shape) < 2:
+                continue
+            total = observed.sum()
+            expected = observed.sum(axis=1, keepdims=True) * observed.sum(axis=0, keepdims=True) / total
+            chi2 = ((observed - expected) ** 2 / expected).sum()
+            dof = (observed.shape[0] - 1) * (observed.shape[1] - 1)
+            v = math.sqrt(chi2 / (total * (min(observed.shape) - 1)))
+            tests.append({"test": "chi-square", "columns": f"{a} x {b}", "statistic": chi2,
+                          "effect": v, "p": chi2_pvalue(chi2, dof), "detail": f"chi² = {chi2:.1f}, dof = {dof}, Cramér's V = {v:.2f}"})
+    return tests
+
+def statistical_analysis(frame, stats):
+    # `frame` is the in-memory data or the cleaned sample of an out-of-core run; big frames are sampled
+    if len(frame) > STATS_SAMPLE_ROWS:
+        frame = frame.sample(n=STATS_SAMPLE_ROWS, random_state=0)
+    numeric, categorical = analysis_columns(frame, stats)
+    values = frame[numeric].apply(pd.to_numeric, errors='coerce').astype('float64')
+    corr, tests = correlation_tests(values, numeric) if len(numeric) > 1 else (pd.DataFrame(), [])
+    # Without a varying numeric column there is nothing to compare across groups; chi-square still runs
+    summaries, by_group = group_tests(frame, values, numeric, categorical) if numeric else ({}, [])
+    tests += by_group + chi_square_tests(frame, categorical)
+    table = pd.DataFrame(tests, columns=["test", "columns", "statistic", "effect", "p", "detail"])
+    table['q'] = benjamini_hochberg(table['p'])
+    table['significant'] = table['q'] < STATS_ALPHA
+    table = table.sort_values(['significant', 'effect'], ascending=[False, False], ignore_index=True)
+    return {
+        "sample_rows": len(frame),
+        "correlations": corr,
+        "outliers": outlier_table(values) if numeric else pd.DataFrame(),
+        "group_summaries": summaries,
+        "tests": table,
+    }
+
+def analysis_digest(analysis, stats, max_findings=STATS_MAX_FINDINGS):
+    # Compact, ranked and reproducible: this text is all the LLM sees of the data
+    lines = [f"DATASET: {stats.rows:,} rows, {len(stats.columns)} columns"
+             + (f" (tests on a {analysis['sample_rows']:,}-row sample)" if analysis['sample_rows'] < stats.rows else "")]
+    missing = sorted(((c['missing'] / max(stats.rows, 1), col) for col, c in stats.columns.items()
+                      if c['missing'] and c['kind'] != "datetime"), reverse=True)
+    if missing:
+        lines.append("MISSING (imputed): " + "; ".join(f"{col} {rate:.1%}" for rate, col in missing[:5]))
+    outliers = analysis['outliers']
+    if len(outliers):
+        flagged = outliers[outliers['iqr_rate'] > 0].sort_values('iqr_rate', ascending=False).head(5)
+        if len(flagged):
+            lines.append("OUTLIERS (IQR / z>3 / MAD>3.5): " + "; ".join(
+                f"{col} {r.iqr_rate:.1%} / {r.zscore_rate:.1%} / {r.mad_rate:.1%}" for col, r in flagged.iterrows()))
+    significant = analysis['tests'][analysis['tests']['significant']].head(max_findings)
+    lines.append(f"SIGNIFICANT FINDINGS (ranked by effect size, Benjamini-Hochberg q < {STATS_ALPHA}):")
+    if significant.empty:
+        lines.append("none")
+    for i, r in enumerate(significant.itertuples(), start=1):
+        lines.append(f"{i}. {r.test} {r.columns}: {r.detail}, " + ("q < 0.001" if r.q < 0.001 else f"q = {r.q:.3f}"))
+    return "\n".join(lines)
+
+@traced("stage.data_analysis")
+def data_analyst_agent(df, use_cache=True):
+    # `df` is an in-memory DataFrame, or a CSV/Parquet path or file for the out-of-core path
+    report = {}
+    stats = profile_data(df)
+    fill_values = stats.fill_values()
+    plan = stats.dtype_plan()
+    
+    edges = histogram_edges(stats)
+    
+    if isinstance(df, pd.DataFrame):
+        df_clean = clean_chunk(df, fill_values, plan)
+        report['cleaned_data'] = df_clean
+        report['statistics'] = df_clean.describe()
+        report['histograms'] = accumulate_histograms({}, df_clean, edges)
+    else:
+        report['cleaned_data'], report['cleaned_path'], report['histograms'] = stream_clean(df, fill_values, plan, stats.rows, edges=edges)
+        report['statistics'] = stats.describe()
+    report['rows'] = stats.rows
+    report['profile'] = stats
+    report['fill_values'] = fill_values
+    report['histogram_edges'] = edges
+    report['visualizations'] = build_visualizations(report)
+    # Raw frame when it fits in memory (imputation would shrink variances); otherwise the cleaned sample
+    report['analysis'] = statistical_analysis(df if isinstance(df, pd.DataFrame) else report['cleaned_data'], stats)
+    report['digest'] = analysis_digest(report['analysis'], stats)
     
-    stats_text = report['statistics'].to_string()
     prompt = f"""
-    Act as a Lead Data Scientist. Analyze this statistics summary: {stats_text}
+    Act as a Lead Data Scientist. These statistics were computed locally from the dataset;
+    interpret them and do not state any numbers that are not listed here:
+    {report['digest']}
     
     Provide a DETAILED report with 3 sections:
     1. Data Quality Assessment (10 lines)
@@ -207,12 +2084,7 @@ def data_analyst_agent(df):
     3. Research Implications (5 lines)
     """
     try:
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.5 
-        )
-        report['ai_insight'] = response.choices[0].message.content
+        report['ai_insight'] = groq_chat(prompt, temperature=0.5, use_cache=use_cache)
     except:
         report['ai_insight'] = "N/A"
     return report
@@ -220,57 +2092,369 @@ def data_analyst_agent(df):
 # ==========================================
 # 5. MODULE 4: WRITER AGENT (UPDATED - NEW GEMINI SDK)
 # ==========================================
-def writer_agent_universal(topic, literature_data, global_hypothesis, analyst_insight):
+def build_writer_prompt(topic, literature_data, global_hypothesis, analyst_insight):
     context = f"TOPIC: {topic}\n\nLITERATURE:\n"
     for p in literature_data:
         context += f"Title: {p['title']}\nSummary: {p['summary']}\nMethod: {p['methodology']}\nGap: {p['analysis']}\n\n"
     context += f"HYPOTHESES:\n{global_hypothesis}\n\nDATA INSIGHTS:\n{analyst_insight}\n"
     
     prompt = "Write a full academic Research Paper. Sections: Title, Abstract, Intro, Lit Review, Methodology, Results, Conclusion. No Markdown."
+    return f"{context}\n\n{prompt}"
+
+# Each section retrieves its own context: (heading, retrieval query, writing instruction)
+WRITER_SECTIONS = [
+    ("", "overview contribution hypothesis findings", "Start with the paper title on its own line, then an Abstract of about 200 words."),
+    ("Introduction", "motivation problem gap hypothesis", "Motivate the problem, state the research gap and the hypotheses."),
+    ("Literature Review", "summary prior work themes", "Synthesise the prior work, grouping papers by theme."),
+    ("Methodology", "methodology methods algorithms data", "Describe the methods and data, drawing on the reviewed approaches."),
+    ("Results", "data insights statistics patterns findings", "Report the results and data insights."),
+    ("Conclusion", "gap hypothesis implications future work", "Conclude with implications, limitations and future work."),
+]
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in FTS_STOPWORDS]
+
+def split_passages(text, max_chars=WRITER_CHUNK_CHARS):
+    passages = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text or ""):
+        if current and len(current) + len(paragraph) > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        passages.append(current)
+    return [p[i:i + max_chars * 2] for p in passages for i in range(0, len(p), max_chars * 2)]
+
+def build_kb_chunks(literature_data, global_hypothesis, analyst_insight):
+    chunks = []
+    for p in literature_data:
+        for field, label in (("summary", "Summary"), ("methodology", "Method"), ("analysis", "Gap"), ("hypothesis", "Hypothesis")):
+            for passage in split_passages(p.get(field, "")):
+                chunks.append(f"[{p['title']}] {label}: {passage}")
+    chunks += [f"HYPOTHESES: {passage}" for passage in split_passages(global_hypothesis)]
+    chunks += [f"DATA INSIGHTS: {passage}" for passage in split_passages(analyst_insight)]
+    return chunks
+
+class BM25Index:
+    # In-memory Okapi BM25 over the knowledge-base passages
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.texts = texts
+        self.k1 = k1
+        self.b = b
+        self.docs = [tokenize(t) for t in texts]
+        self.lengths = np.array([len(d) for d in self.docs], dtype=np.float64)
+        self.avg_length = self.lengths.mean() if len(self.docs) else 0.0
+        self.term_freqs = []
+        doc_freq = {}
+        for doc in self.docs:
+            tf = {}
+            for term in doc:
+                tf[term] = tf.get(term, 0) + 1
+            self.term_freqs.append(tf)
+            for term in tf:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        n = len(self.docs)
+        self.idf = {t: np.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freq.items()}
+
+    def scores(self, query):
+        scores = np.zeros(len(self.docs))
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / max(self.avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            if term not in self.idf:
+                continue
+            tf = np.array([d.get(term, 0) for d in self.term_freqs], dtype=np.float64)
+            scores += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def pack(self, query, token_budget):
+        # Best-scoring passages first until the budget is spent, then restored to KB order for readability
+        picked = []
+        used = 0
+        for i in np.argsort(-self.scores(query), kind="stable"):
+            cost = estimate_tokens(self.texts[i])
+            if used + cost > token_budget:
+                continue
+            picked.append(i)
+            used += cost
+        return "\n\n".join(self.texts[i] for i in sorted(picked))
+
+def build_section_prompt(topic, heading, instruction, context):
+    target = f'the "{heading}" section' if heading else "the title and abstract"
+    return f"""
+    Act as an academic author writing one part of a research paper on: "{topic}".
+    Write ONLY {target}. {instruction}
+    Do not repeat the section heading. No Markdown.
     
+    RELEVANT CONTEXT:
+    {context}
+    """
+
+def write_section(topic, heading, instruction, context, use_cache=True):
+    text = gemini_generate(build_section_prompt(topic, heading, instruction, context), use_cache=use_cache)
+    return f"{heading}\n\n{text.strip()}" if heading else text.strip()
+
+def write_sections(topic, literature_data, global_hypothesis, analyst_insight, use_cache=True):
+    # Yields finished sections in paper order while later sections are still being generated
+    index = BM25Index(build_kb_chunks(literature_data, global_hypothesis, analyst_insight))
+    with ThreadPoolExecutor(max_workers=WRITER_MAX_WORKERS) as pool:
+        futures = [
+            pool.submit(in_context(write_section), topic, heading, instruction,
+                        index.pack(f"{topic} {heading} {query}", WRITER_SECTION_TOKEN_BUDGET), use_cache)
+            for heading, query, instruction in WRITER_SECTIONS
+        ]
+        for future in futures:
+            yield future.result()
+
+def needs_context_packing(prompt):
+    return estimate_tokens(prompt) > WRITER_SINGLE_CALL_TOKENS
+
+@traced("stage.write")
+def writer_agent_universal(topic, literature_data, global_hypothesis, analyst_insight, use_cache=True):
     try:
+        prompt = build_writer_prompt(topic, literature_data, global_hypothesis, analyst_insight)
+        if needs_context_packing(prompt):
+            # Large KBs: bounded per-section prompts generated concurrently, then stitched together
+            text = "\n\n".join(write_sections(topic, literature_data, global_hypothesis, analyst_insight, use_cache=use_cache))
+            return text, "Gemini-2.5-Flash"
         # 🟢 NEW: Using google.genai syntax with gemini-2.5-flash
-        response = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=f"{context}\n\n{prompt}"
-        )
-        return response.text, "Gemini-2.5-Flash"
+        text = gemini_generate(prompt, use_cache=use_cache)
+        return text, "Gemini-2.5-Flash"
     except Exception as e:
         return f"Error: {str(e)}", "None"
 
-class PDF(FPDF):
-    def header(self):
-        self.set_font('Arial', 'B', 12)
-        self.cell(0, 10, 'Agentic AI Research Report', 0, 1, 'C')
-        self.ln(5)
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-
-def generate_pdf_from_text(text_content):
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font('Arial', '', 11)
-    clean_text = text_content.encode('latin-1', 'replace').decode('latin-1')
-    pdf.multi_cell(0, 6, clean_text)
-    return pdf.output(dest='S').encode('latin-1')
+def writer_agent_stream(topic, literature_data, global_hypothesis, analyst_insight, use_cache=True, stats=None):
+    try:
+        prompt = build_writer_prompt(topic, literature_data, global_hypothesis, analyst_insight)
+        if not needs_context_packing(prompt):
+            yield from gemini_stream(prompt, use_cache=use_cache, stats=stats)
+            return
+        stats = stats if stats is not None else {}
+        start = time.perf_counter()
+        parts = []
+        for i, section in enumerate(write_sections(topic, literature_data, global_hypothesis, analyst_insight, use_cache=use_cache)):
+            if i == 0:
+                stats['time_to_first_token'] = time.perf_counter() - start
+            parts.append(section)
+            yield section if i == 0 else f"\n\n{section}"
+        stats['cached'] = False
+        stats['tokens'] = estimate_tokens("".join(parts))
+        stats['tokens_per_sec'] = stats['tokens'] / max(time.perf_counter() - start - stats.get('time_to_first_token', 0.0), 1e-6)
+    except Exception as e:
+        yield f"Error: {str(e)}"
+
+@functools.lru_cache(maxsize=1)
+def unicode_font_files():
+    # (regular, bold) TTF paths, or None when only the core latin-1 fonts can be used.
+    # Parsed font metrics are pickled under the cache dir, so each TTF is only parsed once.
+    for regular in ([PDF_FONT_PATH] if PDF_FONT_PATH else PDF_FONT_CANDIDATES):
+        if regular and os.path.exists(regular):
+            from fpdf import set_global as set_fpdf_global
+            font_cache = os.path.join(CACHE_DIR, "fonts")
+            os.makedirs(font_cache, exist_ok=True)
+            set_fpdf_global("FPDF_CACHE_MODE", 2)
+            set_fpdf_global("FPDF_CACHE_DIR", font_cache)
+            root, ext = os.path.splitext(regular)
+            bold = f"{root}-Bold{ext}"
+            return regular, bold if os.path.exists(bold) else regular
+    return None
+
+@functools.lru_cache(maxsize=1)
+def pdf_class():
+    # fpdf is imported the first time a PDF is rendered, not when the app starts
+    from fpdf import FPDF
+
+    class PDF(FPDF):
+        def __init__(self):
+            super().__init__()
+            self.body_font = 'Arial'
+            fonts = unicode_font_files()
+            if fonts:
+                self.add_font('DejaVu', '', fonts[0], uni=True)
+                self.add_font('DejaVu', 'B', fonts[1], uni=True)
+                self.body_font = 'DejaVu'
+
+        def encodable(self, text):
+            # Core fonts only cover latin-1; the embedded TTF takes the text as-is
+            if self.body_font != 'Arial':
+                return text
+            return text.encode('latin-1', 'replace').decode('latin-1')
+
+        def compact_subsets(self):
+            # fpdf 1.7.2 appends every character drawn to the font's subset list and later does
+            # `cid in subset` for each glyph; deduping (order kept, fpdf drops subset[0]) keeps both linear
+            for font in self.fonts.values():
+                if font.get('subset'):
+                    font['subset'] = list(dict.fromkeys(font['subset']))
+
+        def close(self):
+            self.compact_subsets()
+            super().close()
+
+        def header(self):
+            self.compact_subsets()
+            self.set_font(self.body_font, 'B', 12)
+            self.cell(0, 10, 'Agentic AI Research Report', 0, 1, 'C')
+            self.ln(5)
+        def footer(self):
+            self.set_y(-15)
+            self.set_font(self.body_font, '' if self.body_font != 'Arial' else 'I', 8)
+
+    return PDF
+
+def heading_text(line):
+    return re.sub(r"^[#*\s]+|[*\s:]+$", "", line)
+
+class PDFStreamLayout:
+    # Lays out each paragraph as soon as it is complete, so rendering overlaps with generation
+    def __init__(self):
+        self.pdf = pdf_class()()
+        self.pdf.add_page()
+        self.pdf.set_auto_page_break(auto=True, margin=15)
+        self.pending = ""
+        self.blocks = 0
+
+    def _heading(self, text, size, align='L'):
+        # Keep a heading with the paragraph that follows it
+        if self.blocks and self.pdf.get_y() > self.pdf.h - 40:
+            self.pdf.add_page()
+        elif self.blocks:
+            self.pdf.ln(4)
+        self.pdf.set_font(self.pdf.body_font, 'B', size)
+        self.pdf.multi_cell(0, 8, self.pdf.encodable(heading_text(text)), 0, align)
+        self.pdf.ln(2)
+
+    def _body(self, text):
+        self.pdf.set_font(self.pdf.body_font, '', 11)
+        self.pdf.multi_cell(0, 6, self.pdf.encodable(text))
+        self.pdf.ln(6)
+
+    def _write(self, block):
+        block = block.strip("\n")
+        if not block.strip():
+            return
+        first, _, rest = block.partition("\n")
+        if self.blocks == 0 and not rest and len(first) <= 200 and not SECTION_HEADING_RE.match(first):
+            self._heading(first, 15, 'C')
+        elif SECTION_HEADING_RE.match(first):
+            self._heading(first, 13)
+            if rest.strip():
+                self._body(rest.strip("\n"))
+        else:
+            self._body(block)
+        self.blocks += 1
+
+    def feed(self, chunk):
+        self.pending += chunk
+        *done, self.pending = self.pending.split("\n\n")
+        for block in done:
+            self._write(block)
+
+    def finish(self, out=None):
+        # out: None returns bytes, a path writes the file, a file-like object (e.g. BytesIO) is written to.
+        # fpdf keeps the laid-out pages as they are produced, so this only serialises them.
+        with get_tracer().span("pdf.render") as span:
+            self._write(self.pending)
+            self.pending = ""
+            span['attributes']['pages'] = self.pdf.page_no()
+            if isinstance(out, str):
+                self.pdf.output(out, 'F')
+                return out
+            pdf_bytes = self.pdf.output(dest='S').encode('latin-1')
+            if out is None:
+                return pdf_bytes
+            out.write(pdf_bytes)
+            return out
+
+def generate_pdf_from_stream(chunks, out=None):
+    layout = PDFStreamLayout()
+    for chunk in chunks:
+        layout.feed(chunk)
+    return layout.finish(out)
+
+@traced("stage.pdf")
+def generate_pdf_from_text(text_content, out=None):
+    return generate_pdf_from_stream([text_content], out)
+
+def pdf_cache_path(text_content):
+    # Content-addressed, so reruns with the same manuscript reuse the rendered file
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    font = "unicode" if unicode_font_files() else "latin-1"
+    digest = hashlib.sha256(f"{font}\x00{text_content}".encode("utf-8")).hexdigest()
+    return os.path.join(PDF_CACHE_DIR, f"{digest}.pdf")
+
+def cached_pdf(text_content, layout=None):
+    # layout: a PDFStreamLayout already fed with text_content while it streamed in
+    path = pdf_cache_path(text_content)
+    if not os.path.exists(path):
+        # Written under a temporary name first so a half-written file is never served
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        if layout is not None:
+            layout.finish(tmp)
+        else:
+            generate_pdf_from_text(text_content, tmp)
+        os.replace(tmp, path)
+    return path
 
 # ==========================================
 # 6. MODULE 5: DRAFT EDITOR AGENT (UPDATED - NEW GEMINI SDK)
 # ==========================================
+SECTION_HEADING_RE = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]+|\*\*)?(?:\d+(?:\.\d+)*\.?[ \t]+|[IVX]+\.[ \t]+)?"
+    r"(?:abstract|introduction|background|related work|literature review|lit review|methods?|methodology|"
+    r"materials and methods|experiments?|results|discussion|conclusions?|references|acknowledge?ments)\b"
+    # Then only a short title-case phrase ("Results and Discussion", "Experiments on ImageNet") and an
+    # optional colon, so body lines like "Results show gains." are not taken for headings
+    r"(?-i:(?:[ \t]+(?:[A-Z][\w-]*|and|of|for|the|in|on|with|&)){0,6})[ \t]*:?[ \t]*(?:\*\*)?[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+@traced("stage.read_pdf")
 def read_pdf(file):
+    from pdf_extract import extract_text
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
+        return extract_text(file)
     except Exception as e:
         return f"Error reading PDF: {e}"
 
-def editor_agent(draft_text, instruction="Improve flow and academic tone"):
-    prompt = f"""
+def split_units(text, separators=("\n\n", "\n", " ")):
+    # Splits text into pieces no longer than EDITOR_CHUNK_CHARS, preferring paragraph then line boundaries
+    if len(text) <= EDITOR_CHUNK_CHARS:
+        return [text]
+    if not separators:
+        return [text[i:i + EDITOR_CHUNK_CHARS] for i in range(0, len(text), EDITOR_CHUNK_CHARS)]
+    sep, rest = separators[0], separators[1:]
+    pieces = text.split(sep)
+    if len(pieces) == 1:
+        return split_units(text, rest)
+    units = []
+    for i, piece in enumerate(pieces):
+        piece = piece + sep if i < len(pieces) - 1 else piece
+        units.extend(split_units(piece, rest))
+    return units
+
+def split_draft(text, max_chars=EDITOR_CHUNK_CHARS):
+    # Section boundaries first, then greedily pack sections/paragraphs into chunks of at most max_chars
+    starts = [0] + [m.start() for m in SECTION_HEADING_RE.finditer(text) if m.start() > 0] + [len(text)]
+    sections = [text[a:b] for a, b in zip(starts, starts[1:]) if text[a:b].strip()]
+    chunks = []
+    current = ""
+    for section in sections:
+        for unit in split_units(section):
+            if current and len(current) + len(unit) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += unit
+        # A new section starts a new chunk once the current one is reasonably full
+        if len(current) >= max_chars // 2:
+            chunks.append(current)
+            current = ""
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+def build_editor_prompt(draft_text, instruction):
+    return f"""
     Act as a Senior Academic Editor. 
     User Instruction: "{instruction}"
     
@@ -284,19 +2468,420 @@ def editor_agent(draft_text, instruction="Improve flow and academic tone"):
     
     Output in Markdown. Use bold headers.
     """
+
+def build_chunk_editor_prompt(chunk, instruction):
+    # No chunk index in the prompt: the cache key then depends only on chunk content + instruction,
+    # so after a small edit only the changed chunks miss the cache
+    return f"""
+    Act as a Senior Academic Editor. 
+    User Instruction: "{instruction}"
+    
+    Draft Excerpt (one part of a longer document):
+    {chunk}
+    
+    Task:
+    1. Critique: Briefly list the strengths and weaknesses of this excerpt.
+    2. Rewrite: Rewrite the excerpt applying the instruction. Keep its headings.
+    
+    Output exactly two sections, headed CRITIQUE: and REWRITE:
+    """
+
+def build_editor_reduce_prompt(critiques, instruction):
+    notes = "\n\n".join(f"Part {i + 1}:\n{c}" for i, c in enumerate(critiques))
+    return f"""
+    Act as a Senior Academic Editor. 
+    User Instruction: "{instruction}"
+    
+    Section-by-section critique notes for one draft:
+    {notes}
+    
+    Task:
+    1. Critique: Briefly list 3 strengths and 3 weaknesses of the draft as a whole.
+    2. Improvements: Provide a list of specific actionable changes.
+    
+    Output in Markdown. Use bold headers.
+    """
+
+CHUNK_SECTION_RE = re.compile(r"^[ \t#*]*(CRITIQUE|REWRITE)[ \t*]*:?[ \t*]*$|^[ \t#*]*(CRITIQUE|REWRITE)[ \t*]*:", re.IGNORECASE | re.MULTILINE)
+
+def parse_chunk_edit(text):
+    parts = {}
+    matches = list(CHUNK_SECTION_RE.finditer(text))
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        name = (m.group(1) or m.group(2)).lower()
+        parts[name] = text[m.end():nxt.start() if nxt else len(text)].strip()
+    if 'rewrite' not in parts:
+        parts['rewrite'] = text.strip()
+    return parts.get('critique', ""), parts['rewrite']
+
+def edit_chunk(chunk, instruction, use_cache=True):
+    return parse_chunk_edit(gemini_generate(build_chunk_editor_prompt(chunk, instruction), use_cache=use_cache))
+
+def editor_agent_chunked(draft_text, instruction="Improve flow and academic tone", use_cache=True, progress=None):
+    chunks = split_draft(draft_text)
+    edits = [None] * len(chunks)
+    # Map: critique + rewrite every chunk concurrently
+    with ThreadPoolExecutor(max_workers=EDITOR_MAX_WORKERS) as pool:
+        futures = {pool.submit(in_context(edit_chunk), chunk, instruction, use_cache): i for i, chunk in enumerate(chunks)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            edits[futures[future]] = future.result()
+            if progress:
+                progress(done, len(chunks))
+    # Reduce: merge the per-chunk critiques into one report and stitch the rewrites back in order
+    summary = gemini_generate(build_editor_reduce_prompt([c for c, _ in edits], instruction), use_cache=use_cache)
+    rewrite = "\n\n".join(r for _, r in edits)
+    return f"{summary}\n\n**Rewrite**\n\n{rewrite}"
+
+@traced("stage.edit")
+def editor_agent(draft_text, instruction="Improve flow and academic tone", use_cache=True, progress=None):
     try:
+        if len(draft_text) > EDITOR_CHUNK_CHARS:
+            return editor_agent_chunked(draft_text, instruction, use_cache=use_cache, progress=progress)
         # 🟢 NEW: Using google.genai syntax with gemini-2.5-flash
-        response = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt
-        )
-        return response.text
+        return gemini_generate(build_editor_prompt(draft_text, instruction), use_cache=use_cache)
     except Exception as e:
         return f"Editing Error (Gemini): {e}"
 
+def editor_agent_stream(draft_text, instruction="Improve flow and academic tone", use_cache=True, stats=None):
+    try:
+        yield from gemini_stream(build_editor_prompt(draft_text, instruction), use_cache=use_cache, stats=stats)
+    except Exception as e:
+        yield f"Editing Error (Gemini): {e}"
+
+# ==========================================
+# BACKGROUND JOBS
+# ==========================================
+JOB_ACTIVE = ("queued", "running")
+
+class JobStore:
+    # Persistent job table (status, stage, progress, result) plus one row per saved partial result
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT, owner TEXT, params TEXT, status TEXT, stage TEXT,
+            done INTEGER, total INTEGER, result TEXT, error TEXT, created REAL, updated REAL)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS job_partials (
+            job_id TEXT, key TEXT, value TEXT, PRIMARY KEY (job_id, key))""")
+        self.conn.commit()
+
+    def create(self, kind, params, owner):
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            now = time.time()
+            self.conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, 'queued', NULL, 0, 0, NULL, NULL, ?, ?)",
+                              (job_id, kind, owner, json.dumps(params, default=str), now, now))
+            self.conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("""SELECT id, kind, owner, params, status, stage, done, total, result, error, updated
+                FROM jobs WHERE id = ?""", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "owner", "params", "status", "stage", "done", "total", "result", "error", "updated"), row))
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], default=str)
+        with self.lock:
+            assignments = ", ".join(f"{k} = ?" for k in fields)
+            self.conn.execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ?",
+                              (*fields.values(), time.time(), job_id))
+            self.conn.commit()
+
+    def save_partial(self, job_id, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO job_partials VALUES (?, ?, ?)",
+                              (job_id, key, json.dumps(value, default=str)))
+            self.conn.commit()
+
+    def partials(self, job_id, key=None):
+        with self.lock:
+            if key is not None:
+                row = self.conn.execute("SELECT value FROM job_partials WHERE job_id = ? AND key = ?", (job_id, key)).fetchone()
+                return json.loads(row[0]) if row else None
+            rows = self.conn.execute("SELECT key, value FROM job_partials WHERE job_id = ?", (job_id,)).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def unfinished(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created", JOB_ACTIVE).fetchall()
+        return [r[0] for r in rows]
+
+@st.cache_resource
+def get_job_store():
+    return JobStore(os.path.join(CACHE_DIR, "jobs.sqlite"))
+
+class Job:
+    # Handle passed to job handlers: params, partial results saved by earlier attempts, and progress reporting
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        record = store.get(job_id)
+        self.kind = record['kind']
+        self.owner = record['owner']
+        self.params = record['params']
+        self.partial = store.partials(job_id)
+
+    def save(self, key, value):
+        self.partial[key] = value
+        self.store.save_partial(self.id, key, value)
+
+    def progress(self, stage, done=0, total=1):
+        self.store.update(self.id, stage=stage, done=done, total=total)
+
+def stream_to_partial(job, chunks, on_chunk=None):
+    # Drains a text stream, checkpointing the text so far for pollers every JOB_PARTIAL_INTERVAL seconds
+    parts = []
+    last = time.monotonic()
+    for chunk in chunks:
+        parts.append(chunk)
+        if on_chunk:
+            on_chunk(chunk)
+        if time.monotonic() - last > JOB_PARTIAL_INTERVAL:
+            job.save('draft', "".join(parts))
+            last = time.monotonic()
+    text = "".join(parts)
+    job.save('draft', text)
+    return text
+
+def run_research_job(job):
+    p = job.params
+    clean = job.partial.get('clean')
+    if clean is None:
+        job.progress("fetch")
+        raw = fetch_papers(p['topic'], limit=p.get('fetch_limit', RESEARCH_FETCH_LIMIT))
+        job.progress("clean")
+        clean = clean_and_deduplicate(raw, keep=p.get('keep', 5), topic=p['topic'])
+        if p.get('full_text'):
+            job.progress("fulltext")
+            attach_full_text(clean)
+        job.save('clean', clean)
+
+    def save_paper(i, paper):
+        # Failed analyses are not checkpointed, so a resumed run retries them
+        if not paper.get('summary', '').startswith("Error:"):
+            job.save(f"paper:{i}", paper)
+
+    completed = {int(k.split(":", 1)[1]): v for k, v in job.partial.items() if k.startswith("paper:")}
+    kb = agent_logic_processor(clean, use_cache=p['use_cache'], completed=completed, on_result=save_paper,
+                               progress=lambda done, total: job.progress("analyze", done, total))
+    global_hyp = job.partial.get('global_hypothesis')
+    if global_hyp is None:
+        job.progress("hypothesis")
+        global_hyp = global_hypothesis_generator(kb, p['topic'], use_cache=p['use_cache'])
+        job.save('global_hypothesis', global_hyp)
+    return {"papers": kb, "global_hypothesis": global_hyp}
+
+def run_write_job(job):
+    p = job.params
+    stats = {}
+    layout = None
+    paper_text = job.partial.get('paper_text')
+    if paper_text is None:
+        job.progress("write")
+        # The PDF is laid out paragraph by paragraph while the text is still being generated
+        layout = PDFStreamLayout()
+        paper_text = stream_to_partial(job, writer_agent_stream(
+            p['topic'], p['papers'], p['global_hypothesis'], p['analyst_insight'], use_cache=p['use_cache'], stats=stats
+        ), on_chunk=layout.feed)
+        job.save('paper_text', paper_text)
+    job.progress("pdf")
+    return {"paper_text": paper_text, "pdf_path": cached_pdf(paper_text, layout), "stream_stats": stats}
+
+def run_edit_job(job):
+    # Chunked edits are keyed by content in the LLM cache, so a resumed job only pays for unfinished chunks
+    p = job.params
+    stats = {}
+    if len(p['draft']) > EDITOR_CHUNK_CHARS:
+        text = editor_agent(p['draft'], p['instruction'], use_cache=p['use_cache'],
+                            progress=lambda done, total: job.progress("edit", done, total))
+    else:
+        job.progress("edit")
+        text = stream_to_partial(job, editor_agent_stream(p['draft'], p['instruction'], use_cache=p['use_cache'], stats=stats))
+    return {"editor_response": text, "stream_stats": stats}
+
+JOB_HANDLERS = {"research": run_research_job, "write": run_write_job, "edit": run_edit_job}
+
+class JobRunner:
+    # Local worker pool; jobs left queued/running by a previous process are picked up again on start
+    def __init__(self, store, max_workers):
+        self.store = store
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        for job_id in store.unfinished():
+            self.pool.submit(self._run, job_id)
+
+    def submit(self, kind, params, owner):
+        job_id = self.store.create(kind, params, owner)
+        self.pool.submit(self._run, job_id)
+        return job_id
+
+    def resume(self, job_id):
+        self.store.update(job_id, status="queued", error=None)
+        self.pool.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        # Fresh context per job: no span or user leaks between jobs sharing a pool thread
+        contextvars.Context().run(self._execute, job_id)
+
+    def _execute(self, job_id):
+        job = Job(self.store, job_id)
+        current_user.set(job.owner)
+        self.store.update(job_id, status="running")
+        try:
+            with get_tracer().span(f"job.{job.kind}", job_id=job_id) as span:
+                result = JOB_HANDLERS[job.kind](job)
+                result['trace_id'] = span['trace_id']
+            self.store.update(job_id, status="done", stage="done", result=result)
+        except Exception as e:
+            self.store.update(job_id, status="error", error=str(e))
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(get_job_store(), JOB_MAX_WORKERS)
+
+# ==========================================
+# HEADLESS PIPELINE
+# ==========================================
+class ResearchPipeline:
+    # Scout -> Hypothesis -> ManuScriptor without Streamlit widgets; see batch.py for the CLI.
+    # `progress(topic, stage, done, total)` replaces the progress bar and status boxes.
+    def __init__(self, fetch_limit=RESEARCH_FETCH_LIMIT, keep=5, use_cache=True, write_paper=True, progress=None,
+                 full_text=FULLTEXT_MODE):
+        self.fetch_limit = fetch_limit
+        self.full_text = full_text
+        self.keep = keep
+        self.use_cache = use_cache
+        self.write_paper = write_paper
+        self.progress = progress
+
+    def _report(self, topic, stage, done=0, total=1):
+        if self.progress:
+            self.progress(topic, stage, done, total)
+
+    def run(self, topic, analyst_insight="No Data Analysis Performed."):
+        with get_tracer().span("pipeline.run", topic=topic) as span:
+            result = self._run(topic, analyst_insight)
+            result['trace_id'] = span['trace_id']
+            return result
+
+    def _run(self, topic, analyst_insight):
+        self._report(topic, "fetch")
+        raw = fetch_papers(topic, limit=self.fetch_limit)
+        self._report(topic, "clean")
+        clean = clean_and_deduplicate(raw, keep=self.keep, topic=topic)
+        if self.full_text:
+            self._report(topic, "fulltext")
+            attach_full_text(clean)
+        kb = agent_logic_processor(clean, use_cache=self.use_cache,
+                                   progress=lambda done, total: self._report(topic, "analyze", done, total))
+        self._report(topic, "hypothesis")
+        global_hyp = global_hypothesis_generator(kb, topic, use_cache=self.use_cache)
+        result = {"topic": topic, "papers": kb, "global_hypothesis": global_hyp}
+        
+        if self.write_paper:
+            self._report(topic, "write")
+            paper_text, model_used = writer_agent_universal(topic, kb, global_hyp, analyst_insight, use_cache=self.use_cache)
+            self._report(topic, "pdf")
+            result.update(paper_text=paper_text, model=model_used, pdf=generate_pdf_from_text(paper_text))
+        self._report(topic, "done", 1, 1)
+        return result
+
 # ==========================================
 # 6. MAIN UI
 # ==========================================
+def show_stream_stats(stats):
+    if stats.get('cached'):
+        st.caption("⚡ Served from response cache")
+    elif 'time_to_first_token' in stats:
+        st.caption(f"⏱️ First token after {stats['time_to_first_token']:.2f}s · {stats['tokens_per_sec']:.0f} tokens/s")
+
+def show_trace(trace_id):
+    spans = get_tracer().trace(trace_id) if trace_id else []
+    root = next((s for s in spans if s['parent_id'] is None), None)
+    if root is None:
+        return
+    depth = {}
+    rows = []
+    for span in spans:
+        depth[span['span_id']] = depth.get(span['parent_id'], -1) + 1
+        attrs = span['attributes']
+        rows.append({
+            "stage": "    " * depth[span['span_id']] + span['name'],
+            "ms": round(span['duration'] * 1000, 1),
+            "prompt tokens": attrs.get('prompt_tokens'),
+            "completion tokens": attrs.get('completion_tokens'),
+            "cache hit": attrs.get('cache_hit'),
+            "retries": attrs.get('retries'),
+            "status": span['status']
+        })
+    with st.expander(f"⏱️ Timing breakdown ({root['duration']:.2f}s)"):
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+def submit_job(kind, params):
+    # The job id lives in the URL, so a refreshed page picks the same job back up
+    job_id = get_job_runner().submit(kind, params, st.session_state.user_id)
+    st.query_params[f"{kind}_job"] = job_id
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_progress(job_id, on_done):
+    job = get_job_store().get(job_id)
+    if job is None:
+        st.session_state.applied_jobs.add(job_id)
+        return
+    if job['status'] in JOB_ACTIVE:
+        stage = job['stage'] or "queued"
+        st.progress(min(job['done'] / max(job['total'], 1), 1.0), text=f"⏳ {stage} · {job['done']}/{job['total']}")
+        draft = get_job_store().partials(job_id, 'draft')
+        if draft:
+            with st.container(height=500):
+                st.write(draft)
+        return
+    # Finished: copy the result into the session once, then rerun the whole page so every tab sees it
+    st.session_state.applied_jobs.add(job_id)
+    if job['status'] == "done":
+        on_done(job)
+    st.rerun()
+
+def follow_job(kind, on_done):
+    job_id = st.query_params.get(f"{kind}_job")
+    if not job_id:
+        return
+    if job_id not in st.session_state.applied_jobs:
+        job_progress(job_id, on_done)
+        return
+    job = get_job_store().get(job_id)
+    if job and job['status'] == "error":
+        st.error(f"Job failed: {job['error']}")
+        if st.button("↻ Resume from last completed stage", key=f"resume_{kind}"):
+            get_job_runner().resume(job_id)
+            st.session_state.applied_jobs.discard(job_id)
+            st.rerun()
+
+def apply_research_job(job):
+    st.session_state.topic = job['params']['topic']
+    st.session_state.final_kb = job['result']['papers']
+    st.session_state.global_hyp = job['result']['global_hypothesis']
+    st.session_state.traces['research'] = job['result']['trace_id']
+
+def apply_write_job(job):
+    st.session_state.writer_pdf = job['result']['pdf_path']
+    st.session_state.writer_text = job['result']['paper_text']
+    st.session_state.job_stats['write'] = job['result']['stream_stats']
+    st.session_state.traces['writer'] = job['result']['trace_id']
+
+def apply_edit_job(job):
+    st.session_state.editor_response = job['result']['editor_response']
+    st.session_state.job_stats['edit'] = job['result']['stream_stats']
+    st.session_state.traces['editor'] = job['result']['trace_id']
+
 def main():
     st.set_page_config(page_title="Agentic Research AI", layout="wide")
     
@@ -377,6 +2962,41 @@ def main():
         st.session_state.current_df = None
     if 'editor_response' not in st.session_state: 
         st.session_state.editor_response = ""
+    if 'traces' not in st.session_state: 
+        st.session_state.traces = {}
+    if 'writer_pdf' not in st.session_state: 
+        st.session_state.writer_pdf = None
+    if 'writer_text' not in st.session_state: 
+        st.session_state.writer_text = ""
+    if 'applied_jobs' not in st.session_state: 
+        st.session_state.applied_jobs = set()
+    if 'job_stats' not in st.session_state: 
+        st.session_state.job_stats = {}
+    if 'user_id' not in st.session_state: 
+        st.session_state.user_id = uuid.uuid4().hex
+    # Upstream calls made during this rerun are scheduled fairly against other sessions
+    current_user.set(st.session_state.user_id)
+    # The first rerun after a restart starts the runner, which resumes jobs the previous process left unfinished
+    get_job_runner()
+
+    # --- SIDEBAR: RESPONSE CACHE ---
+    with st.sidebar:
+        st.subheader("⚡ Response Cache")
+        use_cache = st.toggle("Reuse cached LLM responses", value=True)
+        cache_stats_slot = st.empty()
+        if st.button("Clear Cache"):
+            get_llm_cache().clear()
+        if LOCAL_DATA_DIR:
+            with st.expander("📦 Local Paper Store"):
+                dump_path = st.text_input(f"arXiv metadata dump (JSON lines) in {LOCAL_DATA_DIR}:", value="")
+                if st.button("Import Dump") and dump_path:
+                    resolved = local_data_path(dump_path)
+                    if resolved is None:
+                        st.warning(f"File not found in {LOCAL_DATA_DIR}.")
+                    else:
+                        with st.spinner("Importing metadata..."):
+                            count = get_paper_store().import_arxiv_metadata(resolved)
+                        st.success(f"Imported {count} papers.")
 
     # TABS
     tab_research, tab_hypothesis, tab_analyst, tab_writer, tab_editor = st.tabs([
@@ -396,13 +3016,15 @@ def main():
             placeholder="Enter your research topic..."
         )
         
+        full_text = st.checkbox("📄 Analyse full text (methods/results)", value=FULLTEXT_MODE,
+                                help="Downloads each paper's PDF; slower on first run, cached afterwards.")
+        
         if st.button("Start Research Agents"):
-            with st.status("Research in progress...", expanded=True):
-                raw = fetch_papers(st.session_state.topic, limit=8)
-                clean = clean_and_deduplicate(raw)
-                st.session_state.final_kb = agent_logic_processor(clean)
-                st.session_state.global_hyp = global_hypothesis_generator(st.session_state.final_kb, st.session_state.topic)
-            st.success("Research Complete!")
+            # Runs in the background job pool; widget clicks and refreshes no longer interrupt it
+            submit_job("research", {"topic": st.session_state.topic, "use_cache": use_cache,
+                                    "fetch_limit": RESEARCH_FETCH_LIMIT, "full_text": full_text})
+        follow_job("research", apply_research_job)
+        show_trace(st.session_state.traces.get('research'))
 
         if st.session_state.final_kb:
             st.divider()
@@ -442,54 +3064,99 @@ def main():
     with tab_analyst:
         st.header("📈 Analytica")
         uploaded_file = st.file_uploader("Upload CSV", type=["csv"])
-        if uploaded_file:
-            st.session_state.current_df = pd.read_csv(uploaded_file)
-        elif st.button("Generate Synthetic Data"):
-            with st.spinner("Generating synthetic data..."):
-                csv_str = generate_synthetic_data(st.session_state.topic)
-                if csv_str: 
-                    st.session_state.current_df = pd.read_csv(StringIO(csv_str))
-                    st.success("Synthetic Data Created!")
+        large_path = st.text_input(f"...or analyse a large CSV/Parquet file in {LOCAL_DATA_DIR} (out-of-core):",
+                                   value="") if LOCAL_DATA_DIR else ""
+        if uploaded_file and uploaded_file.size > LARGE_CSV_BYTES:
+            # Too big to hold as one frame: keep only the source and stream it in chunks
+            st.session_state.current_df = uploaded_file
+        elif uploaded_file:
+            st.session_state.current_df = downcast_frame(pd.read_csv(uploaded_file))
+        elif large_path:
+            resolved = local_data_path(large_path)
+            if resolved is not None:
+                st.session_state.current_df = resolved
+            else:
+                st.warning(f"File not found in {LOCAL_DATA_DIR}.")
+        else:
+            c1, c2 = st.columns(2)
+            synthetic_rows = c1.number_input("Synthetic rows", min_value=10, max_value=100_000_000, value=1000, step=1000)
+            synthetic_seed = c2.number_input("Random seed", min_value=0, value=0, step=1)
+            if st.button("Generate Synthetic Data"):
+                with get_tracer().span("ui.synthetic_data") as run, st.spinner("Generating synthetic data..."):
+                    st.session_state.current_df, schema = generate_synthetic_data(
+                        st.session_state.topic, rows=int(synthetic_rows), seed=int(synthetic_seed), use_cache=use_cache
+                    )
+                    st.session_state.traces['analyst'] = run['trace_id']
+                st.success("Synthetic Data Created!")
+                with st.expander("Generated schema"):
+                    st.json(schema)
 
         if st.session_state.current_df is not None:
-            st.dataframe(st.session_state.current_df.head())
+            st.dataframe(preview_data(st.session_state.current_df))
             if st.button("Run Analyst Agent"):
-                with st.spinner("Analyzing dataset..."):
-                    st.session_state.analyst_result = data_analyst_agent(st.session_state.current_df)
+                with get_tracer().span("ui.analyst") as run, st.spinner("Analyzing dataset..."):
+                    st.session_state.analyst_result = data_analyst_agent(st.session_state.current_df, use_cache=use_cache)
+                st.session_state.traces['analyst'] = run['trace_id']
                 st.success("Analysis Complete!")
+        show_trace(st.session_state.traces.get('analyst'))
                 
         if st.session_state.analyst_result:
             with st.container(border=True):
                 res = st.session_state.analyst_result
                 st.write("### 🧠 Deep Statistical Narrative")
                 st.success(res['ai_insight'])
+                with st.expander("🔬 Statistical findings"):
+                    st.code(res['digest'], language=None)
+                    st.dataframe(res['analysis']['tests'], use_container_width=True, hide_index=True)
+                    if len(res['analysis']['outliers']):
+                        st.dataframe(res['analysis']['outliers'], use_container_width=True)
+                    if len(res['analysis']['correlations']) > 1:
+                        st.dataframe(res['analysis']['correlations'].round(2), use_container_width=True)
+                if res.get('cleaned_path'):
+                    st.caption(f"{res['rows']:,} rows analysed out-of-core · cleaned data written to {res['cleaned_path']}")
                 st.write("### 📉 Visualization")
-                numeric_cols = res['cleaned_data'].select_dtypes(include=['number'])
-                if not numeric_cols.empty:
-                    st.bar_chart(numeric_cols)
-                else:
+                if not res['histograms']:
                     st.warning("No numeric data columns found for visualization.")
+                else:
+                    quantiles = res['statistics'].loc[['min', '25%', '50%', '75%', 'max']]
+                    st.dataframe(quantiles, use_container_width=True)
+                chart_cols = st.columns(2)
+                for i, spec in enumerate(res['visualizations']):
+                    with chart_cols[i % 2]:
+                        st.caption(f"{spec['column']} · {spec['chart']}")
+                        if spec['chart'] == "line":
+                            st.line_chart(spec['data'])
+                        else:
+                            st.bar_chart(spec['data'])
 
     # --- TAB 4: WRITER AGENT ---
     with tab_writer:
         st.header("✍️ ManuScriptor")
         if st.session_state.final_kb:
             if st.button("Generate PDF Report"):
-                with st.spinner("Writing paper..."):
-                    insight = st.session_state.analyst_result['ai_insight'] if st.session_state.analyst_result else "No Data Analysis Performed."
-                    full_text, model_used = writer_agent_universal(
-                        st.session_state.topic, 
-                        st.session_state.final_kb, 
-                        st.session_state.global_hyp, 
-                        insight
-                    )
-                    pdf_bytes = generate_pdf_from_text(full_text)
+                insight = st.session_state.analyst_result['ai_insight'] if st.session_state.analyst_result else "No Data Analysis Performed."
+                submit_job("write", {
+                    "topic": st.session_state.topic,
+                    "papers": st.session_state.final_kb,
+                    "global_hypothesis": st.session_state.global_hyp,
+                    "analyst_insight": insight,
+                    "use_cache": use_cache
+                })
+            follow_job("write", apply_write_job)
+            if st.session_state.writer_text:
+                with st.container(height=500):
+                    st.write(st.session_state.writer_text)
+                show_stream_stats(st.session_state.job_stats.get('write', {}))
+            # Served from the rendered file, so reruns never rebuild the PDF
+            if st.session_state.writer_pdf and os.path.exists(st.session_state.writer_pdf):
+                with open(st.session_state.writer_pdf, "rb") as f:
                     st.download_button(
                         label="⬇️ Download Final PDF",
-                        data=pdf_bytes,
+                        data=f,
                         file_name="Final_Research_Paper.pdf",
                         mime="application/pdf"
                     )
+            show_trace(st.session_state.traces.get('writer'))
         else:
             st.warning("Please complete the Research Phase (Tab 1) first.")
 
@@ -524,16 +3191,18 @@ def main():
         
         if st.button("Analyze & Improve Draft"):
             if draft_content:
-                with st.spinner("reviewing your work..."):
-                    st.session_state.editor_response = editor_agent(draft_content, edit_instruction)
-                st.success("Editing Complete!")
+                # Long drafts take the chunked map-reduce path inside the job
+                submit_job("edit", {"draft": draft_content, "instruction": edit_instruction, "use_cache": use_cache})
             else:
                 st.warning("Please provide some text to edit.")
+        follow_job("edit", apply_edit_job)
+        show_trace(st.session_state.traces.get('editor'))
         
         # Display Results
         if st.session_state.editor_response:
             st.markdown("### 📝 Editor Feedback & Rewrite")
             st.markdown(st.session_state.editor_response)
+            show_stream_stats(st.session_state.job_stats.get('edit', {}))
             
             # Download revised text
             st.download_button(
@@ -543,5 +3212,13 @@ def main():
                 mime="text/markdown"
             )
 
+    # Filled last so the counters include every call made during this rerun
+    stats = get_llm_cache().stats()
+    with cache_stats_slot.container():
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Hits", stats['hits'])
+        c2.metric("Misses", stats['misses'])
+        c3.metric("Entries", stats['entries'])
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import app
+
+# ==========================================
+# BATCH RESEARCH CLI
+# ==========================================
+# Usage: python batch.py topics.txt --out results --workers 4
+# One topic per line; blank lines and lines starting with '#' are ignored.
+
+print_lock = threading.Lock()
+
+def slugify(topic):
+    return re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")[:80] or "topic"
+
+def load_topics(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def print_progress(topic, stage, done, total):
+    with print_lock:
+        print(f"[{topic[:40]}] {stage} {done}/{total}", file=sys.stderr, flush=True)
+
+def run_topic(topic, out_dir, options):
+    start = time.perf_counter()
+    topic_dir = os.path.join(out_dir, slugify(topic))
+    os.makedirs(topic_dir, exist_ok=True)
+    # Each topic gets its own fairness bucket, so one slow topic cannot starve the others
+    app.current_user.set(f"batch:{topic}")
+    try:
+        result = app.ResearchPipeline(progress=print_progress, **options).run(topic)
+    except Exception as e:
+        return {"topic": topic, "status": "error", "error": str(e), "seconds": time.perf_counter() - start}
+    
+    pdf_bytes = result.pop("pdf", None)
+    if pdf_bytes:
+        with open(os.path.join(topic_dir, "paper.pdf"), "wb") as f:
+            f.write(pdf_bytes)
+    with open(os.path.join(topic_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return {"topic": topic, "status": "ok", "dir": topic_dir, "seconds": time.perf_counter() - start}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Scholar Bot research pipeline over a file of topics.")
+    parser.add_argument("topics", help="text file with one research topic per line")
+    parser.add_argument("--out", default="batch_output", help="output directory (default: batch_output)")
+    parser.add_argument("--workers", type=int, default=4, help="topics processed concurrently (default: 4)")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    parser.add_argument("--limit", type=int, default=app.RESEARCH_FETCH_LIMIT,
+                        help=f"papers fetched per topic before re-ranking (default: {app.RESEARCH_FETCH_LIMIT})")
+    parser.add_argument("--keep", type=int, default=5, help="papers analysed per topic (default: 5)")
+    parser.add_argument("--no-cache", action="store_true", help="skip the LLM response cache lookups")
+    parser.add_argument("--no-paper", action="store_true", help="stop after the global hypotheses")
+    parser.add_argument("--full-text", action="store_true", help="analyse methods/results from each paper's PDF")
+    args = parser.parse_args(argv)
+    
+    topics = load_topics(args.topics)
+    os.makedirs(args.out, exist_ok=True)
+    options = {"fetch_limit": args.limit, "keep": args.keep, "use_cache": not args.no_cache, "write_paper": not args.no_paper,
+               "full_text": args.full_text}
+    executor_cls = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    
+    failures = 0
+    with executor_cls(max_workers=args.workers) as pool, \
+            open(os.path.join(args.out, "summary.jsonl"), "a", encoding="utf-8") as summary:
+        futures = [pool.submit(run_topic, topic, args.out, options) for topic in topics]
+        for done, future in enumerate(as_completed(futures), start=1):
+            outcome = future.result()
+            failures += outcome['status'] != "ok"
+            summary.write(json.dumps(outcome) + "\n")
+            summary.flush()
+            print(f"{done}/{len(topics)} {outcome['status']}: {outcome['topic']} ({outcome['seconds']:.1f}s)", flush=True)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+
+# ==========================================
+# OFFLINE BENCHMARK SUITE
+# ==========================================
+# Usage: python benchmark.py --out bench.json [--baseline old.json --threshold 0.2]
+# Every external service is replaced by an in-process stand-in that replays
+# benchmarks/fixtures.json after an injected latency, so runs need no network.
+
+WORK_DIR = tempfile.mkdtemp(prefix="scholar_bench_")
+os.environ.setdefault("SCHOLAR_CACHE_DIR", WORK_DIR)
+os.environ.setdefault("GROQ_REQUESTS_PER_MINUTE", "100000")
+os.environ.setdefault("GROQ_TOKENS_PER_MINUTE", "100000000")
+
+import numpy as np
+import pandas as pd
+
+import app
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_PATH = os.path.join(ROOT, "benchmarks", "fixtures.json")
+
+# Heavy dependencies that must stay unloaded until a stage needs them, keyed by a module that only
+# appears in sys.modules once the package has really executed (lazy stubs are registered up front)
+HEAVY_MODULES = {
+    "pandas": "pandas.core.frame",
+    "arxiv": "feedparser",
+    "PyPDF2": "PyPDF2._reader",
+    "groq": "groq",
+    "google.genai": "google.genai",
+    "fpdf": "fpdf",
+}
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+markers = json.loads(sys.argv[1])
+print(json.dumps({"seconds": elapsed, "loaded": sorted(n for n, m in markers.items() if m in sys.modules)}))
+"""
+
+# ------------------------------------------
+# Transport stand-ins
+# ------------------------------------------
+class FakeArxivSearch:
+    def __init__(self, fixtures, latency):
+        self.fixtures = fixtures
+        self.latency = latency
+
+    def __call__(self, query, max_results, sort_by=None):
+        self.max_results = max_results
+        return self
+
+    def results(self):
+        time.sleep(self.latency)
+        records = self.fixtures['arxiv']
+        for i in range(self.max_results):
+            r = dict(records[i % len(records)])
+            if i >= len(records):
+                base, version = r['entry_id'].rsplit("v", 1)
+                r['entry_id'] = f"{base}{i:03d}v{version}"
+                r['title'] = f"{r['title']} ({i})"
+            yield SimpleNamespace(
+                entry_id=r['entry_id'], title=r['title'], summary=r['summary'], pdf_url=r['pdf_url'],
+                doi=r['doi'], published=datetime.strptime(r['published'], "%Y-%m-%d")
+            )
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+        self.status_code = 200
+        self.raw = SimpleNamespace(retries=None)
+
+    def json(self):
+        return self.payload
+
+class FakeOpenAlexSession:
+    def __init__(self, fixtures, latency):
+        self.works = {w['doi'].lower().replace("https://doi.org/", ""): w for w in fixtures['openalex']}
+        self.latency = latency
+
+    def get(self, url, params=None, timeout=None):
+        time.sleep(self.latency)
+        value = params['filter'].split(":", 1)[1]
+        if params['filter'].startswith("doi:"):
+            return FakeResponse({"results": [self.works[d] for d in value.split("|") if d in self.works]})
+        return FakeResponse({"results": list(self.works.values())[:1]})
+
+class FakeGroq:
+    def __init__(self, fixtures, latency):
+        self.text = fixtures['groq']
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, model, temperature, **kwargs):
+        time.sleep(self.latency)
+        usage = SimpleNamespace(prompt_tokens=app.estimate_tokens(messages[0]['content']),
+                                completion_tokens=app.estimate_tokens(self.text))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.text))], usage=usage)
+
+class FakeGemini:
+    def __init__(self, fixtures, latency, chunks=20):
+        self.text = fixtures['gemini']
+        self.latency = latency
+        self.chunks = chunks
+        self.models = SimpleNamespace(generate_content=self.generate_content,
+                                      generate_content_stream=self.generate_content_stream)
+
+    def generate_content(self, model, contents, **kwargs):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=self.text, usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, **kwargs):
+        step = max(1, len(self.text) // self.chunks)
+        time.sleep(self.latency)
+        for i in range(0, len(self.text), step):
+            yield SimpleNamespace(text=self.text[i:i + step], usage_metadata=None)
+
+def install_fakes(fixtures, latency):
+    session = FakeOpenAlexSession(fixtures, latency['openalex'])
+    app.arxiv.Search = FakeArxivSearch(fixtures, latency['arxiv'])
+    app.get_http_session = lambda: session
+    groq, gemini = FakeGroq(fixtures, latency['groq']), FakeGemini(fixtures, latency['gemini'])
+    app.get_groq_client = lambda: groq
+    app.get_gemini_client = lambda: gemini
+
+# ------------------------------------------
+# Measurement
+# ------------------------------------------
+def measure(fn, repeat, memory=True):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = {"median_s": statistics.median(times), "min_s": min(times), "repeat": repeat}
+    if memory:
+        # Separate traced run: tracemalloc slows allocation-heavy code, so it never feeds the timings
+        tracemalloc.start()
+        fn()
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result
+
+def measure_import(repeat):
+    # Fresh interpreter per run: cold-start cost is what every new worker process pays
+    times = []
+    loaded = set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", IMPORT_PROBE, json.dumps(HEAVY_MODULES)], cwd=ROOT,
+                              capture_output=True, text=True, check=True, env={**os.environ, "SCHOLAR_CACHE_DIR": WORK_DIR})
+        probe = json.loads(proc.stdout.strip().splitlines()[-1])
+        times.append(probe['seconds'])
+        loaded.update(probe['loaded'])
+    return {"median_s": statistics.median(times), "min_s": min(times), "repeat": repeat, "eager_modules": sorted(loaded)}
+
+def check_import_budget(result, budget):
+    violations = []
+    if result['median_s'] > budget:
+        violations.append(f"import app: {result['median_s'] * 1000:.0f} ms exceeds the {budget * 1000:.0f} ms budget")
+    if result['eager_modules']:
+        violations.append(f"import app: loads {', '.join(result['eager_modules'])} at startup")
+    return violations
+
+def write_synthetic_csv(path, rows, chunk=1_000_000, seed=0):
+    rng = np.random.default_rng(seed)
+    header = True
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        df = pd.DataFrame({
+            "t": np.arange(start, start + n),
+            "score": rng.normal(50, 10, n),
+            "count": rng.integers(0, 1000, n),
+            "group": rng.choice(["control", "treatment", "placebo"], n),
+        })
+        df.loc[rng.random(n) < 0.05, "score"] = np.nan
+        df.to_csv(path, mode="w" if header else "a", header=header, index=False)
+        header = False
+    return path
+
+def page_text(pages, chars_per_page=3000):
+    paragraph = "This paragraph stands in for a page of manuscript text written in an academic register. " * 5
+    body = (paragraph + "\n\n") * (chars_per_page // len(paragraph))
+    return "".join(f"Section {i + 1}\n\n{body}" for i in range(pages))
+
+def paper_records(fixtures, n):
+    # Without an arxiv_id the local store can neither answer nor remember enrichment, so every run is cold
+    records = [dict(p) for p in app.fetch_papers("benchmark topic", limit=n, use_store=False)]
+    for p in records:
+        p.pop('arxiv_id', None)
+    return records
+
+def run_benchmarks(args, fixtures):
+    results = {"import_app": {**measure_import(args.repeat), "params": {"budget_s": args.import_budget}}}
+    print(f"{'import_app':45s} {results['import_app']['median_s'] * 1000:10.1f} ms", file=sys.stderr, flush=True)
+    latency = args.latency
+
+    def record(name, fn, repeat=args.repeat, memory=True, **params):
+        results[name] = {**measure(fn, repeat, memory), "params": params}
+        print(f"{name:45s} {results[name]['median_s'] * 1000:10.1f} ms", file=sys.stderr, flush=True)
+
+    record("fetch_papers[network]", lambda: app.fetch_papers("benchmark topic", limit=args.papers, use_store=False),
+           papers=args.papers, latency=latency)
+    app.fetch_papers("benchmark topic", limit=args.papers)
+    record("fetch_papers[store]", lambda: app.fetch_papers("benchmark topic", limit=args.papers), papers=args.papers)
+
+    records = paper_records(fixtures, args.papers)
+    record("clean_and_deduplicate[cold]", lambda: app.clean_and_deduplicate([dict(p) for p in records]),
+           papers=args.papers, latency=latency)
+
+    clean = app.clean_and_deduplicate([dict(p) for p in records], keep=args.papers)
+    record("agent_logic_processor", lambda: app.agent_logic_processor([dict(p) for p in clean], use_cache=False),
+           papers=len(clean), latency=latency, workers=app.GROQ_MAX_WORKERS)
+
+    record("parse_markdown_sections", lambda: [app.parse_markdown_sections(fixtures['groq']) for _ in range(1000)],
+           memory=False, iterations=1000)
+
+    for rows in args.csv_rows:
+        path = write_synthetic_csv(os.path.join(WORK_DIR, f"synthetic_{rows}.csv"), rows)
+        if rows <= 1_000_000:
+            df = pd.read_csv(path)
+            record(f"data_analyst_agent[df,{rows}]", lambda: app.data_analyst_agent(df, use_cache=False),
+                   repeat=1 if rows > 100_000 else args.repeat, rows=rows)
+        record(f"data_analyst_agent[csv,{rows}]", lambda: app.data_analyst_agent(path, use_cache=False),
+               repeat=1 if rows > 100_000 else args.repeat, memory=rows <= 1_000_000, rows=rows)
+
+    schema = app.validate_synthetic_schema(app.DEFAULT_SYNTHETIC_SCHEMA)
+    for rows in args.csv_rows:
+        record(f"sample_synthetic_data[{rows}]", lambda: app.sample_synthetic_data(schema, rows, seed=0),
+               repeat=1 if rows > 100_000 else args.repeat, rows=rows)
+
+    for pages in args.pdf_pages:
+        text = page_text(pages)
+        record(f"generate_pdf_from_text[{pages}]", lambda: app.generate_pdf_from_text(text),
+               repeat=1 if pages > 100 else args.repeat, pages=pages)
+        pdf_bytes = app.generate_pdf_from_text(text)
+        record(f"read_pdf[{pages}]", lambda: app.read_pdf(BytesIO(pdf_bytes)),
+               repeat=1 if pages > 100 else args.repeat, pages=pages)
+    return results
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = current['median_s'] / max(previous['median_s'], 1e-9)
+        current['vs_baseline'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {previous['median_s'] * 1000:.1f} ms -> {current['median_s'] * 1000:.1f} ms ({ratio:.2f}x)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for every Scholar Bot pipeline stage.")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results JSON")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (default: 0.2 = 20%%)")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="recorded API responses to replay")
+    parser.add_argument("--latency", type=float, default=0.05, help="injected per-call latency in seconds (default: 0.05)")
+    parser.add_argument("--papers", type=int, default=8, help="papers per research run (default: 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per benchmark (default: 3)")
+    parser.add_argument("--csv-rows", type=int, nargs="+", default=[1_000, 100_000], help="synthetic CSV sizes")
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[1, 50], help="PDF sizes in pages")
+    parser.add_argument("--import-budget", type=float, default=1.5, help="max seconds for a cold `import app` (default: 1.5)")
+    args = parser.parse_args(argv)
+
+    with open(args.fixtures, encoding="utf-8") as f:
+        fixtures = json.load(f)
+    install_fakes(fixtures, {"arxiv": args.latency, "openalex": args.latency, "groq": args.latency, "gemini": args.latency})
+
+    results = run_benchmarks(args, fixtures)
+    report = {
+        "meta": {"created": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+                 "latency_s": args.latency},
+        "results": results
+    }
+    regressions = check_import_budget(results['import_app'], args.import_budget)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions += compare(results, json.load(f), args.threshold)
+    report['regressions'] = regressions
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
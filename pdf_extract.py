@@ -0,0 +1,16 @@
+import io
+
+import PyPDF2
+
+# ==========================================
+# PDF TEXT EXTRACTION
+# ==========================================
+# Shared by the Draft Editor upload and app.py's full-text process pool. Kept out of app.py so
+# pool workers only import PyPDF2, not Streamlit and the API SDKs.
+
+def extract_text(source):
+    # `source` is PDF bytes or a binary file object. PyPDF2 resolves the whole page tree up front,
+    # so this is not streamed; only the per-page text is produced lazily before joining.
+    reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    # Newline between pages so the heading at the top of a page still starts its own line
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its configuration at import time: point the caches at a throwaway directory first
+os.environ.setdefault("SCHOLAR_CACHE_DIR", tempfile.mkdtemp(prefix="scholar_test_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
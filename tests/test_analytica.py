@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def test_large_integer_ids_round_trip_through_stream_clean(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ids = [100000001, np.nan, 100000002, 100000004]
+    path = tmp_path / "ids.csv"
+    pd.DataFrame({"id": ids, "score": [1.5, 2.5, np.nan, 4.5]}).to_csv(path, index=False)
+
+    stats = app.profile_data(str(path))
+    plan = stats.dtype_plan()
+    assert plan["id"] == np.float64
+    assert plan["score"] == np.float32
+
+    sample, cleaned_path, _ = app.stream_clean(str(path), stats.fill_values(), plan, stats.rows,
+                                               output_path=str(tmp_path / "cleaned.parquet"))
+    cleaned = pq.read_table(cleaned_path).to_pandas()
+    assert cleaned["id"].iloc[[0, 2, 3]].tolist() == [100000001, 100000002, 100000004]
+    assert sample["id"].std() > 0
+    assert stats.describe().loc["std", "id"] > 0
+
+
+def test_local_data_path_stays_inside_data_dir(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "big.csv").write_text("a\n1\n")
+    (tmp_path / "secret.txt").write_text("x")
+    (data_dir / "link.csv").symlink_to(tmp_path / "secret.txt")
+
+    monkeypatch.setattr(app, "LOCAL_DATA_DIR", "")
+    assert app.local_data_path("big.csv") is None
+
+    monkeypatch.setattr(app, "LOCAL_DATA_DIR", str(data_dir))
+    assert app.local_data_path("big.csv") == str((data_dir / "big.csv").resolve())
+    assert app.local_data_path(str(data_dir / "big.csv")) == str((data_dir / "big.csv").resolve())
+    for path in ("/etc/passwd", "../secret.txt", "link.csv", "missing.csv", ""):
+        assert app.local_data_path(path) is None
@@ -0,0 +1,51 @@
+import pytest
+
+import app
+
+NUMBERED_THEMES = """SUMMARY:
+The paper proposes a graph network for molecules.
+
+METHODOLOGY:
+Message passing over molecular graphs with learned edge functions.
+
+ANALYSIS:
+**Key Themes:**
+1. **Graph Representation**: molecules as graphs.
+2. **Methodology**: message passing with learned edges.
+3. **Scalability**: linear in the number of atoms.
+**Critical Research Gap:** no evaluation on large proteins.
+
+HYPOTHESIS:
+**Attention-weighted messages improve protein property prediction.**
+"""
+
+
+def test_numbered_list_items_do_not_open_sections():
+    sections = app.parse_markdown_sections(NUMBERED_THEMES)
+    assert sections["methodology"] == "Message passing over molecular graphs with learned edge functions."
+    assert "2. **Methodology**: message passing" in sections["analysis"]
+    assert "3. **Scalability**" in sections["analysis"]
+    assert "Critical Research Gap" in sections["analysis"]
+    assert not app.missing_sections(sections)
+
+
+def test_numbered_heading_alone_on_its_line():
+    sections = app.parse_markdown_sections("1. Summary\nsum\n2. Methodology:\nmeth\n3. ANALYSIS: ana\n4. **Hypothesis**\nhyp")
+    assert sections == {"summary": "sum", "methodology": "meth", "analysis": "ana", "hypothesis": "hyp"}
+
+
+def test_headers_on_one_line():
+    sections = app.parse_markdown_sections("SUMMARY: s. METHODOLOGY: m. ANALYSIS: a. HYPOTHESIS: h.")
+    assert sections == {"summary": "s.", "methodology": "m.", "analysis": "a.", "hypothesis": "h."}
+
+
+@pytest.mark.parametrize("line", ["Results", "3. Results and Discussion", "## Methods", "**Conclusion:**",
+                                  "IV. Experiments on ImageNet", "Materials and Methods", "1.2 Related Work"])
+def test_section_headings(line):
+    assert app.SECTION_HEADING_RE.match(line)
+
+
+@pytest.mark.parametrize("line", ["Results show gains.", "Results: accuracy improved by 3%",
+                                  "Methods based on attention were proposed by [3] and refined"])
+def test_body_lines_are_not_section_headings(line):
+    assert not app.SECTION_HEADING_RE.match(line)
@@ -0,0 +1,14 @@
+import os
+
+import app
+
+
+def test_span_logs_are_rotated_by_size(tmp_path):
+    tracer = app.Tracer(str(tmp_path), otel=True, max_bytes=2000)
+    for i in range(200):
+        with tracer.span("stage.test", i=i):
+            pass
+    assert sorted(os.listdir(tmp_path)) == ["otel_spans.jsonl", "otel_spans.jsonl.1", "spans.jsonl", "spans.jsonl.1"]
+    for name in os.listdir(tmp_path):
+        # One span past the limit at most before the file is rotated
+        assert os.path.getsize(tmp_path / name) <= 3000